@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+
+
+class FailureStorm(object):
+    '''
+        Counts failures by their exception type, message and failing URL,
+        so that once more than threshold tests have failed the same way
+        (such as when the application under test goes down) only every
+        sample'th of those failures has its details captured.
+    '''
+
+    def __init__(self, threshold, sample=10):
+        self.threshold = threshold
+        self.sample = sample
+        self.counts = {}
+        # the first fingerprint to pass the threshold
+        self.storm = None
+        self._lock = threading.Lock()
+
+    def fingerprint(self, excinfo, url):
+        # unlike str, exconly copes with messages that are not ascii
+        message = excinfo.exconly()[len(excinfo.typename) + 2:]
+        lines = message.strip().splitlines()
+        return (excinfo.typename, lines and lines[0][:200] or '', url)
+
+    def record(self, fingerprint):
+        '''
+            Counts a failure, returning whether its details should be
+            captured.
+        '''
+        with self._lock:
+            count = self.counts[fingerprint] = self.counts.get(fingerprint, 0) + 1
+            if count <= self.threshold:
+                return True
+            if self.storm is None:
+                self.storm = fingerprint
+            return (count - self.threshold) % self.sample == 0
+
+    def describe(self, fingerprint):
+        typename, message, url = fingerprint
+        return '%i tests failed with %s: %s%s' % (
+            self.counts.get(fingerprint, 0), typename, message,
+            url and ' at %s' % url or '')
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import random
+import re
+import sys
+import threading
+import time
+import traceback
+from timeit import default_timer as timer
+
+try:
+    import fcntl
+except ImportError:
+    # sessions are only limited within each process without file locking
+    fcntl = None
+
+import requests
+
+import http_session
+
+
+def status_url(options, sauce_labs_credentials=None):
+    '''
+        Returns the url to check that the selenium server (or Sauce Labs)
+        is up, or None if browsers are started locally.
+    '''
+    if sauce_labs_credentials:
+        import sauce_labs
+        return '%s/info/status' % sauce_labs.API_URL
+    if options.api == 'rc' or options.driver == 'Remote':
+        return 'http://%s:%s/wd/hub/status' % (options.host, options.port)
+
+
+def check_status(url, timeout):
+    '''
+        Requests the status url, returning the reason that browsers can't
+        be started, or None if the server is up.
+    '''
+    try:
+        r = http_session.get(url, timeout=timeout)
+    except requests.RequestException, e:
+        return 'Unable to reach the selenium server. (URL: %s, Error: %s)' % (url, e)
+    if r.status_code != 200:
+        return 'Selenium server did not return status code 200. (URL: %s, Response: %s)' % (
+            url, r.status_code)
+    try:
+        status = r.json()
+    except ValueError:
+        return None
+    # sauce labs reports whether it is able to start browsers
+    if isinstance(status, dict) and status.get('service_operational') is False:
+        return 'Sauce Labs is not operational. (Status: %s)' % status.get('status_message')
+
+
+def error_message(error):
+    '''
+        Returns the message of error as it appears in a traceback, which,
+        unlike str, copes with messages that are not ascii.
+    '''
+    line = traceback.format_exception_only(type(error), error)[-1]
+    return line[len(type(error).__name__) + 2:].strip()
+
+
+# errors from the selenium server or Sauce Labs meaning that there is no
+# capacity to start another browser yet
+CAPACITY_ERRORS = re.compile(
+    'capacity|concurren|too many|busy|queue|forwarding the new session|'
+    'waiting for a node|status code 503', re.IGNORECASE)
+
+
+def is_capacity_error(error):
+    return bool(CAPACITY_ERRORS.search(error_message(error)))
+
+
+def start_with_retry(start, retries=3, backoff=5):
+    '''
+        Calls start, retrying with jittered exponential backoff up to retries
+        times if it fails because there is no capacity. Returns the time
+        spent waiting between attempts, plus any time spent waiting that
+        start returns.
+    '''
+    waited = 0
+    for attempt in range(retries + 1):
+        try:
+            return waited + (start() or 0)
+        except Exception, e:
+            if attempt == retries or not is_capacity_error(e):
+                raise
+        delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        time.sleep(delay)
+        waited += delay
+
+
+class SessionSlots(object):
+    '''
+        Limits the number of browser sessions open at once to size, across
+        every process sharing the directory (such as pytest-xdist slaves)
+        by locking one of size files for each session.
+    '''
+
+    def __init__(self, directory, size, poll=0.5):
+        self.directory = directory
+        self.size = size
+        self.poll = poll
+        self._semaphore = fcntl is None and threading.Semaphore(size)
+
+    def acquire(self, block=True, timeout=None):
+        '''
+            Waits for a free slot, returning it along with the time spent
+            waiting. Without block, returns None for the slot instead of
+            waiting when none is free. Gives up with an error once timeout
+            seconds have been spent waiting.
+        '''
+        start = timer()
+        while True:
+            slot = self._take()
+            if slot or not block:
+                return (slot, timer() - start)
+            if timeout and timer() - start >= timeout:
+                raise Exception(
+                    'Timed out after %s seconds waiting for one of the %i '
+                    'browsers allowed by --maxsessions to close.' % (timeout, self.size))
+            time.sleep(self.poll)
+
+    def _take(self):
+        if self._semaphore:
+            return self._semaphore.acquire(False) or None
+        for i in range(self.size):
+            slot = open(os.path.join(self.directory, 'slot%i' % i), 'a')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except IOError:
+                slot.close()
+
+    def release(self, slot):
+        if self._semaphore:
+            self._semaphore.release()
+        else:
+            fcntl.flock(slot, fcntl.LOCK_UN)
+            slot.close()
+
+
+class CircuitBreaker(object):
+    '''
+        Counts consecutive failures to start a browser, so that once
+        threshold browsers in a row have failed to start the remaining tests
+        can fail without trying. A threshold of 0 never trips.
+    '''
+
+    def __init__(self, threshold=0):
+        self.threshold = threshold
+        self.failures = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+    @property
+    def tripped(self):
+        return bool(self.threshold) and self.failures >= self.threshold
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+
+    def failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.error = error
+
+    def reason(self):
+        if self.tripped:
+            return 'Not starting a browser as the last %i attempts failed. (Error: %s)' % (
+                self.failures, error_message(self.error))
+
+
+def parse_hub(value):
+    '''
+        Returns the hub described by value as host:port, or host:port:capacity
+        for a hub that can only run capacity sessions at once.
+    '''
+    parts = value.split(':')
+    try:
+        if len(parts) not in (2, 3) or not parts[0]:
+            raise ValueError
+        return Hub(parts[0], int(parts[1]), len(parts) == 3 and int(parts[2]) or 0)
+    except ValueError:
+        raise ValueError("Invalid hub: '%s'. Hubs must be given as host:port or host:port:capacity." % value)
+
+
+class Hub(object):
+
+    def __init__(self, host, port, capacity=0):
+        self.host = host
+        self.port = port
+        # the number of sessions the hub can run at once, or 0 if unlimited
+        self.capacity = capacity
+        self.in_flight = 0
+        # the reason the hub can't start browsers, if it is down
+        self.down = None
+
+    @property
+    def address(self):
+        return '%s:%s' % (self.host, self.port)
+
+    @property
+    def load(self):
+        return self.capacity and float(self.in_flight) / self.capacity or self.in_flight
+
+    @property
+    def full(self):
+        return bool(self.capacity) and self.in_flight >= self.capacity
+
+
+class HubScheduler(object):
+    '''
+        Spreads browser sessions across several selenium servers, starting
+        each one on the hub with the lowest share of its capacity in use (or
+        the fewest sessions, for hubs without a capacity) and failing over to
+        the other hubs when a session can't be started.
+    '''
+
+    def __init__(self, hubs, poll=0.5):
+        self.hubs = hubs
+        self.poll = poll
+        self._condition = threading.Condition()
+
+    @property
+    def addresses(self):
+        return tuple(hub.address for hub in self.hubs)
+
+    def check(self, timeout):
+        '''
+            Checks the status of every hub, so that hubs that are down are
+            not used. Returns the reason browsers can't be started if every
+            hub is down, or None.
+        '''
+        for hub in self.hubs:
+            hub.down = check_status(
+                'http://%s/wd/hub/status' % hub.address, timeout)
+        if all(hub.down for hub in self.hubs):
+            return 'No selenium server is available. (%s)' % ' '.join(
+                hub.down for hub in self.hubs)
+
+    def acquire(self, exclude=()):
+        '''
+            Waits for a hub that is not excluded to have free capacity,
+            returning it along with the time spent waiting, or None if there
+            are no other hubs to try.
+        '''
+        start = timer()
+        with self._condition:
+            while True:
+                hubs = [hub for hub in self.hubs
+                        if hub not in exclude and not hub.down]
+                if not hubs:
+                    return (None, timer() - start)
+                free = [hub for hub in hubs if not hub.full]
+                if free:
+                    hub = min(free, key=lambda hub: hub.load)
+                    hub.in_flight += 1
+                    return (hub, timer() - start)
+                # other processes do not notify, so check again periodically
+                self._condition.wait(self.poll)
+
+    def release(self, hub):
+        with self._condition:
+            hub.in_flight -= 1
+            self._condition.notify()
+
+    def start(self, client, start):
+        '''
+            Calls start with the client pointed at the least loaded hub,
+            trying each of the other hubs in turn if it fails. Records each
+            attempt in the client's hub_starts, and returns the time spent
+            waiting for capacity.
+        '''
+        tried = []
+        waited = 0
+        error = None
+        while True:
+            hub, wait = self.acquire(tried)
+            waited += wait
+            if hub is None:
+                if error:
+                    raise error[0], error[1], error[2]
+                raise Exception('No selenium server is available.')
+            client.host, client.port = hub.host, hub.port
+            begin = timer()
+            try:
+                start()
+            except Exception:
+                error = sys.exc_info()
+                client.hub_starts.append((hub.address, timer() - begin, False))
+                self.release(hub)
+                tried.append(hub)
+                continue
+            client.hub = hub
+            client.hub_starts.append((hub.address, timer() - begin, True))
+            return waited
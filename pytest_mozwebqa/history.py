@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import optparse
+import os
+import sqlite3
+import sys
+import time
+
+import html_report
+
+# the most recent runs of each test used to estimate its duration
+ESTIMATE_RUNS = 5
+# columns added since the database was first written, created when missing
+COLUMNS = (('build', 'TEXT'), ('browser', 'TEXT'), ('url', 'TEXT'),
+           ('session_id', 'TEXT'))
+# outcomes counting towards durations, and outcomes counting as failures
+TIMED_OUTCOMES = ('passed', 'failed')
+FAILED_OUTCOMES = ('failed', 'error')
+
+
+def history_path(options):
+    '''
+        Returns the path of the history database, which is kept alongside
+        the report unless given.
+    '''
+    if options.webqa_history_path:
+        return html_report.report_path(options.webqa_history_path)
+    if options.webqa_report_path:
+        return os.path.join(
+            os.path.dirname(html_report.report_path(options.webqa_report_path)),
+            'history.sqlite')
+
+
+def browser_configuration(options):
+    '''
+        Returns a description of the browser the tests run in, so that the
+        results of the same test in different browsers are kept apart.
+    '''
+    if options.api == 'rc':
+        return options.environment or options.browser
+    if options.driver.upper() == 'REMOTE':
+        return ' '.join(str(value) for value in (
+            options.browser_name, options.browser_version, options.platform) if value)
+    return options.driver
+
+
+def connect(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    connection = sqlite3.connect(path)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS results ('
+        'nodeid TEXT, recorded REAL, outcome TEXT, duration REAL, %s)' %
+        ', '.join('%s REAL' % phase for phase in html_report.PHASES))
+    existing = [row[1] for row in connection.execute('PRAGMA table_info(results)')]
+    for name, type in COLUMNS:
+        if name not in existing:
+            connection.execute('ALTER TABLE results ADD COLUMN %s %s' % (name, type))
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS results_nodeid ON results (nodeid, recorded)')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS results_build ON results (build, nodeid, browser)')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS results_recorded ON results (recorded)')
+    with connection:
+        # runs recorded without a --build are each a build of their own
+        connection.execute('UPDATE results SET build = recorded WHERE build IS NULL')
+    return connection
+
+
+def estimates(path, runs=ESTIMATE_RUNS):
+    '''
+        Returns the average duration of the last runs of each test that
+        passed or failed, by node id.
+    '''
+    if not os.path.exists(path):
+        return {}
+    connection = connect(path)
+    try:
+        durations = {}
+        for nodeid, duration in connection.execute(
+                "SELECT nodeid, duration FROM results "
+                "WHERE outcome IN %s "
+                "ORDER BY nodeid, recorded DESC" % _placeholders(TIMED_OUTCOMES),
+                TIMED_OUTCOMES):
+            if len(durations.setdefault(nodeid, [])) < runs:
+                durations[nodeid].append(duration)
+        return dict((nodeid, sum(values) / len(values))
+                    for nodeid, values in durations.items())
+    finally:
+        connection.close()
+
+
+def _estimate(estimates, nodeid):
+    # tests that have not run before are assumed to take an average time
+    if nodeid in estimates:
+        return estimates[nodeid]
+    return estimates and sum(estimates.values()) / len(estimates) or 1
+
+
+def longest_first(nodeids, estimates):
+    '''
+        Returns the node ids ordered by their estimated duration, longest
+        first, keeping the collected order between tests with the same
+        estimate.
+    '''
+    return sorted(nodeids, key=lambda nodeid: -_estimate(estimates, nodeid))
+
+
+def plan_shards(nodeids, estimates, count):
+    '''
+        Splits the node ids into count shards taking about the same time,
+        by giving each test in turn, longest first, to the shard with the
+        least time so far. The same node ids and estimates always give the
+        same shards.
+    '''
+    shards = [[] for i in range(count)]
+    totals = [0] * count
+    for nodeid in longest_first(sorted(nodeids), estimates):
+        shard = totals.index(min(totals))
+        shards[shard].append(nodeid)
+        totals[shard] += _estimate(estimates, nodeid)
+    return shards
+
+
+def _placeholders(values):
+    return '(%s)' % ', '.join('?' for value in values)
+
+
+def _builds(connection, count):
+    '''
+        Returns the count builds with the most recent runs, newest first.
+    '''
+    builds = []
+    # every result of a run is recorded at the same time, so step back one
+    # run at a time rather than reading every result
+    row = connection.execute(
+        'SELECT build, recorded FROM results ORDER BY recorded DESC LIMIT 1').fetchone()
+    while row and len(builds) < count:
+        build, recorded = row
+        if build not in builds:
+            builds.append(build)
+        row = connection.execute(
+            'SELECT build, recorded FROM results WHERE recorded < ? '
+            'ORDER BY recorded DESC LIMIT 1', (recorded, )).fetchone()
+    return builds
+
+
+def _results(connection, builds, outcomes):
+    '''
+        Returns the node id, browser, build, outcome and duration of the
+        results in the given builds, oldest first.
+    '''
+    if not builds:
+        return []
+    return connection.execute(
+        'SELECT nodeid, browser, build, outcome, duration '
+        'FROM results WHERE build IN %s AND outcome IN %s ORDER BY recorded' % (
+            _placeholders(builds), _placeholders(outcomes)),
+        tuple(builds) + tuple(outcomes)).fetchall()
+
+
+def slowest(path, builds=10, limit=20):
+    '''
+        Returns the node id, browser and average duration of the limit tests
+        that took longest over the last builds, slowest first.
+    '''
+    connection = connect(path)
+    try:
+        durations = {}
+        for nodeid, browser, build, outcome, duration in _results(
+                connection, _builds(connection, builds), TIMED_OUTCOMES):
+            durations.setdefault((nodeid, browser), []).append(duration)
+    finally:
+        connection.close()
+    averages = [(nodeid, browser, sum(values) / len(values))
+                for (nodeid, browser), values in durations.items()]
+    return sorted(averages, key=lambda row: (-row[2], row[0]))[:limit]
+
+
+def regressions(path, builds=10, threshold=1.5, minimum=1.0):
+    '''
+        Returns the node id, browser, average duration over the previous
+        builds and duration in the latest build of the tests that took at
+        least threshold times, and minimum seconds, longer in the latest
+        build, biggest slow down first.
+    '''
+    connection = connect(path)
+    try:
+        recent = _builds(connection, builds + 1)
+        durations = {}
+        for nodeid, browser, build, outcome, duration in _results(
+                connection, recent, TIMED_OUTCOMES):
+            latest, previous = durations.setdefault((nodeid, browser), ([], []))
+            if build == recent[0]:
+                latest.append(duration)
+            else:
+                previous.append(duration)
+    finally:
+        connection.close()
+    rows = []
+    for (nodeid, browser), (latest, previous) in durations.items():
+        if not (latest and previous):
+            continue
+        before = sum(previous) / len(previous)
+        after = sum(latest) / len(latest)
+        if after >= before * threshold and after - before >= minimum:
+            rows.append((nodeid, browser, before, after))
+    return sorted(rows, key=lambda row: (-(row[3] / (row[2] or 1)), row[0]))
+
+
+def flaky(path, builds=10, limit=20):
+    '''
+        Returns the node id, browser, number of runs, number of failures and
+        number of times the outcome changed between passing and failing for
+        tests that both passed and failed over the last builds, most changes
+        first.
+    '''
+    connection = connect(path)
+    try:
+        outcomes = {}
+        for nodeid, browser, build, outcome, duration in _results(
+                connection, _builds(connection, builds),
+                ('passed', ) + FAILED_OUTCOMES):
+            outcomes.setdefault((nodeid, browser), []).append(
+                outcome in FAILED_OUTCOMES)
+    finally:
+        connection.close()
+    rows = []
+    for (nodeid, browser), failures in outcomes.items():
+        if any(failures) and not all(failures):
+            flips = len([i for i in range(1, len(failures))
+                         if failures[i] != failures[i - 1]])
+            rows.append((nodeid, browser, len(failures), failures.count(True), flips))
+    return sorted(rows, key=lambda row: (-row[4], -row[3], row[0]))[:limit]
+
+
+class HistoryReport(object):
+    '''
+        Records the outcome and duration of each test, the time spent in
+        each phase, and the failing URL and session id, in the history
+        database at the end of the run.
+    '''
+
+    def __init__(self, path, build=None, browser=None):
+        self.path = path
+        self.build = build
+        self.browser = browser
+        self.results = {}
+
+    def pytest_runtest_logreport(self, report):
+        result = self.results.setdefault(
+            report.nodeid, {'outcome': 'passed', 'duration': 0.0, 'timings': {}})
+        result['duration'] += getattr(report, 'duration', 0.0)
+        if report.failed:
+            result['outcome'] = report.when == 'call' and 'failed' or 'error'
+        elif report.skipped and result['outcome'] == 'passed':
+            result['outcome'] = 'skipped'
+        # the teardown report has the time spent in every phase
+        result['timings'].update(getattr(report, 'timings', {}))
+        urls = getattr(report, 'debug', {}).get('urls')
+        if urls:
+            result['url'] = urls[-1]
+        if getattr(report, 'session_id', None):
+            result['session_id'] = report.session_id
+
+    def pytest_sessionfinish(self, session):
+        if not self.results:
+            return
+        recorded = time.time()
+        columns = ['nodeid', 'recorded', 'build', 'browser', 'outcome',
+                   'duration', 'url', 'session_id'] + list(html_report.PHASES)
+        connection = connect(self.path)
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT INTO results (%s) VALUES %s' % (
+                        ', '.join(columns), _placeholders(columns)),
+                    # without a --build the run is keyed by when it was recorded
+                    [(nodeid, recorded, self.build or recorded, self.browser,
+                      result['outcome'], result['duration'],
+                      result.get('url'), result.get('session_id')) +
+                     tuple(result['timings'].get(phase) for phase in html_report.PHASES)
+                     for nodeid, result in sorted(self.results.items())])
+        finally:
+            connection.close()
+
+
+def _print_table(headings, rows, out):
+    rows = [headings] + [[isinstance(value, float) and '%.2f' % value or
+                          unicode(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(headings))]
+    for row in rows:
+        out.write(('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() +
+                   '\n').encode('utf-8'))
+
+
+def main(args=None, out=None):
+    '''
+        Answers questions about previous runs from the history database.
+    '''
+    out = out or sys.stdout
+    parser = optparse.OptionParser(
+        usage='%prog [options] slowest|regressions|flaky',
+        description='Lists the slowest tests, the tests that took longer in '
+                    'the latest build than in previous builds, or the tests '
+                    'that have both passed and failed, from the history '
+                    'kept by pytest-mozwebqa.')
+    parser.add_option('--history',
+                      dest='path',
+                      default='results/history.sqlite',
+                      metavar='path',
+                      help='history database. (default: %default)')
+    parser.add_option('--builds',
+                      type='int',
+                      default=10,
+                      metavar='num',
+                      help='number of recent builds to look at. (default: %default)')
+    parser.add_option('--limit',
+                      type='int',
+                      default=20,
+                      metavar='num',
+                      help='maximum number of tests to list. (default: %default)')
+    parser.add_option('--threshold',
+                      type='float',
+                      default=1.5,
+                      metavar='num',
+                      help='how many times longer a test must take in the latest build to be a regression. (default: %default)')
+    parser.add_option('--minimum',
+                      type='float',
+                      default=1.0,
+                      metavar='num',
+                      help='how many seconds longer a test must take in the latest build to be a regression. (default: %default)')
+    options, args = parser.parse_args(args)
+    if len(args) != 1 or args[0] not in ('slowest', 'regressions', 'flaky'):
+        parser.error('a query of slowest, regressions or flaky must be given.')
+    if not os.path.exists(options.path):
+        parser.error('no history found at %s.' % options.path)
+
+    if args[0] == 'slowest':
+        _print_table(('Test', 'Browser', 'Duration'),
+                     slowest(options.path, options.builds, options.limit), out)
+    elif args[0] == 'regressions':
+        _print_table(('Test', 'Browser', 'Previous', 'Latest'),
+                     regressions(options.path, options.builds, options.threshold,
+                                 options.minimum)[:options.limit], out)
+    else:
+        _print_table(('Test', 'Browser', 'Runs', 'Failures', 'Changes'),
+                     flaky(options.path, options.builds, options.limit), out)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import base64
-import cgi
 import datetime
+import json
+import math
 import os
 import pkg_resources
 import py
@@ -19,67 +19,85 @@ from py.xml import raw
 
 import sauce_labs
 
+# phases of each test that are timed, and their column headings
+PHASES = ('queue', 'start', 'body', 'capture', 'quit')
+PHASE_NAMES = {
+    'queue': 'Capacity Wait',
+    'start': 'Browser Start',
+    'body': 'Test',
+    'capture': 'Capture',
+    'quit': 'Browser Quit'}
+
+OUTCOMES = ('Passed', 'Skipped', 'Failed', 'Error', 'XFailed', 'XPassed')
+
+# stands in for the results, one JSON object per line, in the rendered
+# document
+ROWS = '<!-- results -->'
+
+# failure artifacts that are written to the debug directory, with the file
+# name and link text for each
+ARTIFACTS = (
+    ('screenshots', 'screenshot.png', 'Screenshot'),
+    ('html', 'html.txt', 'HTML'),
+    ('logs', 'log.txt', 'Log'),
+    ('network_traffic', 'networktraffic.json', 'Network Traffic'))
+
+
+def report_path(path):
+    return os.path.normpath(os.path.expanduser(os.path.expandvars(path)))
+
+
+def artifact_paths(logfile, filename, debug_path='debug'):
+    '''
+        Returns the path of an artifact relative to the report, and its full
+        path, creating the directory it is stored in.
+    '''
+    relative_path = os.path.join(debug_path, 'artifacts', filename)
+    full_path = os.path.join(os.path.dirname(logfile), relative_path)
+    if not os.path.exists(os.path.dirname(full_path)):
+        try:
+            os.makedirs(os.path.dirname(full_path))
+        except OSError:
+            # another thread or process may have just created it
+            if not os.path.isdir(os.path.dirname(full_path)):
+                raise
+    return (relative_path, full_path)
+
 
 class HTMLReport(object):
 
     def __init__(self, config):
-        logfile = os.path.expanduser(os.path.expandvars(config.option.webqa_report_path))
-        self.logfile = os.path.normpath(logfile)
-        self._debug_path = 'debug'
+        self.logfile = report_path(config.option.webqa_report_path)
         self.config = config
-        self.test_logs = []
         self.errors = self.failed = 0
         self.passed = self.skipped = 0
         self.xfailed = self.xpassed = 0
         self.resources = ('style.css', 'jquery.js', 'main.js')
-
-    def _debug_paths(self, testclass, testmethod):
-        root_path = os.path.join(os.path.dirname(self.logfile), self._debug_path)
-        root_path = os.path.normpath(os.path.expanduser(os.path.expandvars(root_path)))
-        test_path = os.path.join(testclass.replace('.', '_'), testmethod)
-        full_path = os.path.join(root_path, test_path)
-        if not os.path.exists(full_path):
-            os.makedirs(full_path)
-        relative_path = os.path.join(self._debug_path, test_path)
-        absolute_path = os.path.join(root_path, test_path)
-        return (relative_path, full_path)
+        # call reports waiting for the browser to quit in teardown
+        self._call_reports = {}
+        self.timings = dict((phase, []) for phase in PHASES)
+        # sessions started on, and time spent running tests on, each hub
+        self.hubs = {}
 
     def _appendrow(self, result, report):
         import pytest_mozwebqa
         (testclass, testmethod) = pytest_mozwebqa.split_class_and_test_names(report.nodeid)
         time = getattr(report, 'duration', 0.0)
+        timings = getattr(report, 'timings', {})
+        if report.when == 'call':
+            for phase in PHASES:
+                if phase in timings:
+                    self.timings[phase].append(timings[phase])
 
         links = {}
-        if hasattr(report, 'debug') and any(report.debug.values()):
-            (relative_path, full_path) = self._debug_paths(testclass, testmethod)
-
-            if report.debug['screenshots']:
-                filename = 'screenshot.png'
-                f = open(os.path.join(full_path, filename), 'wb')
-                f.write(base64.decodestring(report.debug['screenshots'][-1]))
-                links.update({'Screenshot': os.path.join(relative_path, filename)})
-
-            if report.debug['html']:
-                filename = 'html.txt'
-                f = open(os.path.join(full_path, filename), 'wb')
-                f.write(report.debug['html'][-1])
-                links.update({'HTML': os.path.join(relative_path, filename)})
-
-            # Log may contain passwords, etc so we only capture it for tests marked as public
-            if report.debug['logs'] and 'public' in report.keywords:
-                filename = 'log.txt'
-                f = open(os.path.join(full_path, filename), 'wb')
-                f.write(report.debug['logs'][-1])
-                links.update({'Log': os.path.join(relative_path, filename)})
-
-            if report.debug['network_traffic']:
-                filename = 'networktraffic.json'
-                f = open(os.path.join(full_path, filename), 'wb')
-                f.write(report.debug['network_traffic'][-1])
-                links.update({'Network Traffic': os.path.join(relative_path, filename)})
-
-            if report.debug['urls']:
-                links.update({'Failing URL': report.debug['urls'][-1]})
+        debug = getattr(report, 'debug', {})
+        # the artifacts have already been written to the debug directory
+        for key, filename, name in ARTIFACTS:
+            if debug.get(key):
+                links[name] = debug[key][-1]['path']
+
+        if debug.get('urls'):
+            links.update({'Failing URL': debug['urls'][-1]})
 
         if self.config.option.sauce_labs_credentials_file and hasattr(report, 'session_id'):
             self.sauce_labs_job = sauce_labs.Job(report.session_id)
@@ -87,48 +105,39 @@ class HTMLReport(object):
         if hasattr(self, 'sauce_labs_job'):
             links['Sauce Labs Job'] = self.sauce_labs_job.url
 
-        links_html = []
-        for name, path in links.iteritems():
-            links_html.append(html.a(name, href=path))
-            links_html.append(' ')
-
-        additional_html = []
+        record = {
+            'result': result,
+            'class': testclass,
+            'name': testmethod,
+            'duration': round(time),
+            'timings': [round(timings.get(phase, 0), 2) for phase in PHASES],
+            'links': sorted(links.items())}
 
         if not 'Passed' in result:
 
             if hasattr(self, 'sauce_labs_job'):
-                additional_html.append(self.sauce_labs_job.video_html)
+                record['video'] = self.sauce_labs_job.video_html.unicode()
 
             if 'Screenshot' in links:
-                additional_html.append(
-                    html.div(
-                        html.a(html.img(src=links['Screenshot']),
-                               href=links['Screenshot']),
-                        class_='screenshot'))
+                record['screenshot'] = links['Screenshot']
+                if debug.get('thumbnails'):
+                    record['thumbnail'] = debug['thumbnails'][-1]['path']
 
             if report.longrepr:
-                log = html.div(class_='log')
+                log = []
                 for line in str(report.longrepr).splitlines():
                     separator = line.startswith('_ ' * 10)
-                    if separator:
-                        log.append(line[:80])
-                    else:
-                        exception = line.startswith("E   ")
-                        if exception:
-                            log.append(html.span(raw(cgi.escape(line)),
-                                                 class_='error'))
-                        else:
-                            log.append(raw(cgi.escape(line)))
-                    log.append(html.br())
-                additional_html.append(log)
-
-        self.test_logs.append(html.tr([
-            html.td(result, class_='col-result'),
-            html.td(testclass, class_='col-class'),
-            html.td(testmethod, class_='col-name'),
-            html.td(round(time), class_='col-duration'),
-            html.td(links_html, class_='col-links'),
-            html.td(additional_html, class_='debug')], class_=result.lower() + ' results-table-row'))
+                    log.append(separator and line[:80] or line)
+                record['log'] = log
+
+        self._write_row(record)
+
+    def _write_row(self, record):
+        # one result per line, escaped so that it can't close the script
+        # element the results are embedded in
+        row = json.dumps(record, separators=(',', ':')).replace('</', '<\\/')
+        self._rows.write(row + '\n')
+        self._rows.flush()
 
     def _make_report_dir(self):
         logfile_dirname = os.path.dirname(self.logfile)
@@ -167,6 +176,36 @@ class HTMLReport(object):
             self.skipped += 1
 
     def pytest_runtest_logreport(self, report):
+        self._record_hub(report)
+        if report.when == 'call':
+            # the row is added once the browser has quit in teardown
+            self._call_reports[report.nodeid] = report
+            return
+        if report.when == 'teardown':
+            call_report = self._call_reports.pop(report.nodeid, None)
+            if call_report:
+                call_report.timings = getattr(report, 'timings', {})
+                self._appendreport(call_report)
+        self._appendreport(report)
+
+    def _record_hub(self, report):
+        for address, seconds, started in getattr(report, 'hub_starts', []):
+            stats = self._hub_stats(address)
+            if started:
+                stats['starts'].append(seconds)
+            else:
+                stats['failures'] += 1
+        if report.when == 'teardown' and getattr(report, 'hub', None):
+            # waiting for capacity does not use the hub
+            timings = getattr(report, 'timings', {})
+            self._hub_stats(report.hub)['busy'] += sum(
+                timings.get(phase, 0) for phase in PHASES if phase != 'queue')
+
+    def _hub_stats(self, address):
+        return self.hubs.setdefault(
+            address, {'starts': [], 'failures': 0, 'busy': 0.0})
+
+    def _appendreport(self, report):
         if report.passed:
             if report.when == 'call':
                 self.append_pass(report)
@@ -180,15 +219,104 @@ class HTMLReport(object):
 
     def pytest_sessionstart(self, session):
         self.suite_start_time = time.time()
+        # rows are written as soon as each test finishes so that a partial
+        # report is left behind if the run does not complete
+        self._make_report_dir()
+        header, footer = self._document(
+            html.p('The test run has not finished.', id='partial'))
+        self._rows = py.std.codecs.open(self.logfile, 'w', encoding='utf-8')
+        self._rows.write(header)
+        self._rows.flush()
+        self._rows_offset = self._rows.tell()
+
+    def _timings_table(self):
+        rows = []
+        for phase in PHASES:
+            timings = sorted(self.timings[phase])
+            if not timings:
+                continue
+            rows.append(html.tr(
+                html.td(PHASE_NAMES[phase]),
+                html.td('%.2f' % sum(timings)),
+                [html.td('%.2f' % _percentile(timings, percent))
+                 for percent in (50, 90, 99)],
+                html.td('%.2f' % timings[-1])))
+        return html.table(
+            html.tr([html.th(heading) for heading in (
+                'Phase', 'Total', 'Median', '90th Percentile',
+                '99th Percentile', 'Maximum')]),
+            rows,
+            id='timings')
+
+    def _hubs_table(self, suite_time):
+        scheduler = getattr(self.config, '_hub_scheduler', None)
+        if not scheduler:
+            return []
+        rows = []
+        for hub in scheduler.hubs:
+            stats = self._hub_stats(hub.address)
+            starts = sorted(stats['starts'])
+            # the average number of sessions in use over the whole run
+            in_use = suite_time and stats['busy'] / suite_time or 0
+            rows.append(html.tr(
+                html.td(hub.address),
+                html.td(hub.capacity or 'Unlimited'),
+                html.td(len(starts)),
+                html.td(stats['failures']),
+                html.td('%.2f' % in_use),
+                html.td(hub.capacity and '%i%%' % (100 * in_use / hub.capacity) or ''),
+                html.td(starts and '%.2f' % _percentile(starts, 50) or ''),
+                html.td(starts and '%.2f' % starts[-1] or '')))
+        return html.table(
+            html.tr([html.th(heading) for heading in (
+                'Hub', 'Capacity', 'Sessions Started', 'Start Failures',
+                'Average In Use', 'Utilisation', 'Median Start',
+                'Maximum Start')]),
+            rows,
+            id='hubs')
 
     def pytest_sessionfinish(self, session, exitstatus, __multicall__):
-        self._make_report_dir()
-        logfile = py.std.codecs.open(self.logfile, 'w', encoding='utf-8')
+        # add any tests that were interrupted before teardown
+        for report in self._call_reports.values():
+            self._appendreport(report)
+        self._call_reports.clear()
+        self._rows.close()
 
         suite_stop_time = time.time()
         suite_time_delta = suite_stop_time - self.suite_start_time
         numtests = self.passed + self.failed + self.xpassed + self.xfailed
 
+        header, footer = self._document(
+            html.h2('Summary'),
+            html.p(
+                '%i tests ran in %i seconds.' % (numtests, suite_time_delta),
+                html.br(),
+                html.span('%i passed' % self.passed, class_='passed'), ', ',
+                html.span('%i skipped' % self.skipped, class_='skipped'), ', ',
+                html.span('%i failed' % self.failed, class_='failed'), ', ',
+                html.span('%i errors' % self.errors, class_='error'), '.',
+                html.br(),
+                html.span('%i expected failures' % self.xfailed, class_='skipped'), ', ',
+                html.span('%i unexpected passes' % self.xpassed, class_='failed'), '.'),
+            self._timings_table(),
+            self._hubs_table(suite_time_delta))
+
+        # the rows that have already been written are copied into the final
+        # report, which replaces the partial one once it is complete
+        path = self.logfile + '.tmp'
+        with open(path, 'wb') as logfile:
+            logfile.write(header.encode('utf-8'))
+            with open(self.logfile, 'rb') as partial:
+                partial.seek(self._rows_offset)
+                shutil.copyfileobj(partial, logfile)
+            logfile.write(footer.encode('utf-8'))
+        os.rename(path, self.logfile)
+
+    def _document(self, *summary):
+        '''
+            Returns the text of the report before and after the rows of the
+            results table.
+        '''
         server = self.config.option.sauce_labs_credentials_file and \
                  'Sauce Labs' or 'http://%s:%s' % (self.config.option.host, self.config.option.port)
         browser = self.config.option.browser_name and \
@@ -232,26 +360,35 @@ class HTMLReport(object):
                 html.table(
                     [html.tr(html.td(k), html.td(v)) for k, v in sorted(configuration.items()) if v],
                     id='configuration'),
-                html.h2('Summary'),
-                html.p(
-                    '%i tests ran in %i seconds.' % (numtests, suite_time_delta),
-                    html.br(),
-                    html.span('%i passed' % self.passed, class_='passed'), ', ',
-                    html.span('%i skipped' % self.skipped, class_='skipped'), ', ',
-                    html.span('%i failed' % self.failed, class_='failed'), ', ',
-                    html.span('%i errors' % self.errors, class_='error'), '.',
-                    html.br(),
-                    html.span('%i expected failures' % self.xfailed, class_='skipped'), ', ',
-                    html.span('%i unexpected passes' % self.xpassed, class_='failed'), '.'),
+                list(summary),
                 html.h2('Results'),
-                html.table([
-                    html.thead(html.tr([
-                        html.th('Result', class_='sortable', col='result'),
-                        html.th('Class', class_='sortable', col='class'),
-                        html.th('Name', class_='sortable', col='name'),
-                        html.th('Duration', class_='sortable numeric', col='duration'),
-                        html.th('Links')]), id='results-table-head'),
-                    html.tbody(*self.test_logs, id='results-table-body')], id='results-table')))
-
-        logfile.write('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">' + doc.unicode(indent=2))
-        logfile.close()
+                html.div(
+                    [html.label(html.input(type='checkbox', class_='outcome',
+                                           value=outcome.lower(), checked='checked'),
+                                outcome)
+                     for outcome in OUTCOMES],
+                    html.label('Class', html.input(type='text', id='filter-class')),
+                    id='filters'),
+                html.div(
+                    html.table([
+                        html.thead(html.tr([
+                            html.th('Result', class_='sortable', col='result'),
+                            html.th('Class', class_='sortable', col='class'),
+                            html.th('Name', class_='sortable', col='name'),
+                            html.th('Duration', class_='sortable numeric', col='duration'),
+                            [html.th(PHASE_NAMES[phase], class_='sortable numeric', col=phase)
+                             for phase in PHASES],
+                            html.th('Links')]), id='results-table-head'),
+                        html.tbody(id='results-table-body')], id='results-table'),
+                    id='results-container'),
+                html.div(id='results-detail'),
+                html.script(raw(ROWS), id='results-data', type='text/plain')))
+
+        return ('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">' +
+                doc.unicode(indent=2)).split(ROWS)
+
+
+def _percentile(values, percent):
+    # nearest rank percentile of a sorted list
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import requests
+from requests.adapters import HTTPAdapter
+from selenium.webdriver.remote import remote_connection
+from selenium.webdriver.remote import utils
+from selenium.webdriver.remote.errorhandler import ErrorCode
+
+# number of hosts to keep connection pools for
+POOL_CONNECTIONS = 10
+# methods that WebDriver commands are sent with
+HTTP_METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+
+_session = None
+_timeout = None
+
+
+def configure(pool_size=10, timeout=None):
+    '''
+        Sets up the HTTP session shared by all requests made by the plugin,
+        which keeps connections to each host alive between requests.
+    '''
+    global _session, _timeout
+    close()
+    _session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                          pool_maxsize=pool_size)
+    _session.mount('http://', adapter)
+    _session.mount('https://', adapter)
+    _timeout = timeout or None
+
+
+def close():
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+def request(method, url, **kwargs):
+    if _session is None:
+        configure()
+    kwargs.setdefault('timeout', _timeout)
+    return _session.request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def put(url, data=None, **kwargs):
+    return request('PUT', url, data=data, **kwargs)
+
+
+class RemoteConnection(remote_connection.RemoteConnection):
+    '''
+        Sends WebDriver commands over the shared HTTP session rather than
+        opening a new connection for every command.
+    '''
+
+    def _request(self, *args, **kwargs):
+        if args and args[0] in HTTP_METHODS:
+            # selenium 2.41 and later call _request(method, url, body=None)
+            method, url = args[:2]
+            data = len(args) > 2 and args[2] or kwargs.get('body')
+        else:
+            # earlier versions call _request(url, data=None, method=None)
+            url = args and args[0] or kwargs['url']
+            data = len(args) > 1 and args[1] or kwargs.get('data')
+            method = len(args) > 2 and args[2] or kwargs.get('method')
+        return self._send(method, url, data)
+
+    def _send(self, method, url, data=None):
+        if method is None:
+            method = data is not None and 'POST' or 'GET'
+        elif method not in ('POST', 'PUT'):
+            data = None
+        response = request(
+            method, url,
+            data=data is not None and data.encode('utf-8') or None,
+            headers={'Accept': 'application/json',
+                     'Content-Type': 'application/json;charset=UTF-8'})
+
+        if response.status_code > 399 and response.status_code < 500:
+            return {'status': response.status_code, 'value': response.text}
+        body = response.content.decode('utf-8').replace('\x00', '').strip()
+        if response.headers.get('content-type', '').startswith('image/png'):
+            return {'status': 0, 'value': body}
+        try:
+            data = utils.load_json(body)
+        except ValueError:
+            if response.status_code > 199 and response.status_code < 300:
+                status = ErrorCode.SUCCESS
+            else:
+                status = ErrorCode.UNKNOWN_ERROR
+            return {'status': status, 'value': body}
+
+        assert type(data) is dict, (
+            'Invalid server response body: %s' % body)
+        assert 'status' in data, (
+            'Invalid server response; no status: %s' % body)
+        # some drivers return a response with no value when it should be null
+        if 'value' not in data:
+            data['value'] = None
+        return data
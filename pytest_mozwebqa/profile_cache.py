@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+# files that are not copied into a profile by selenium
+IGNORED_FILES = ('parent.lock', 'lock', '.parentlock')
+
+
+class EncodedProfile(object):
+    '''
+        A firefox profile that has already been zipped and encoded for a
+        remote webdriver.
+    '''
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+
+
+class ProfileCache(object):
+    '''
+        Keeps encoded firefox profiles keyed by a hash of everything that
+        goes into them, so that each distinct profile is only built once per
+        session, or once across sessions if a directory is given.
+    '''
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.profiles = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, create, profile_path, preferences, extensions, assume_untrusted):
+        with self._lock:
+            # the profile directory and extensions are only hashed once
+            options = (profile_path, json.dumps(preferences, sort_keys=True),
+                       tuple(extensions), assume_untrusted)
+            if options not in self._keys:
+                self._keys[options] = self.key(
+                    profile_path, preferences, extensions, assume_untrusted)
+            key = self._keys[options]
+            if key not in self.profiles:
+                self.profiles[key] = self._load(key) or self._build(key, create)
+        return EncodedProfile(self.profiles[key])
+
+    def key(self, profile_path, preferences, extensions, assume_untrusted):
+        digest = hashlib.sha1()
+        digest.update(json.dumps([preferences, assume_untrusted], sort_keys=True))
+        if profile_path:
+            _update_from_path(digest, profile_path)
+        for extension in extensions:
+            digest.update(os.path.basename(extension))
+            _update_from_path(digest, extension)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, '%s.b64' % key)
+
+    def _load(self, key):
+        if self.directory and os.path.isfile(self._path(key)):
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+
+    def _build(self, key, create):
+        profile = create()
+        try:
+            encoded = profile.encoded
+        finally:
+            shutil.rmtree(profile.path, ignore_errors=True)
+            if profile.tempfolder is not None:
+                shutil.rmtree(profile.tempfolder, ignore_errors=True)
+        if self.directory:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            # write to a temporary file first so that other processes never
+            # read a partially written profile
+            fd, path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(encoded)
+            os.rename(path, self._path(key))
+        return encoded
+
+
+def _update_from_path(digest, path):
+    if not os.path.isdir(path):
+        return _update_from_file(digest, path)
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name not in IGNORED_FILES:
+                filename = os.path.join(root, name)
+                digest.update(os.path.relpath(filename, path))
+                _update_from_file(digest, filename)
+
+
+def _update_from_file(digest, path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            digest.update(chunk)
@@ -4,17 +4,73 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import base64
+import hashlib
+import os
 import py
 import re
+import shutil
+import tempfile
+import threading
+import time
 import ConfigParser
+from timeit import default_timer as timer
 
-import requests
+import pytest
 
 import credentials
+import grid
+import history
+import html_report
+import http_session
+import screenshots
+from failure_storm import FailureStorm
+from session_pool import SessionPool
+from threaded_runner import ThreadedRunner
 
 __version__ = '1.1'
 
+BROWSER_SCOPES = {
+    'function': None,
+    'class': pytest.Class,
+    'module': pytest.Module,
+    'session': pytest.Session}
+
 def pytest_configure(config):
+    config._hub_scheduler = None
+    if config.option.hubs:
+        try:
+            hubs = [grid.parse_hub(hub) for hub in config.option.hubs]
+        except ValueError, e:
+            raise pytest.UsageError(str(e))
+        config._hub_scheduler = grid.HubScheduler(hubs)
+    try:
+        config.option.start_backoff = float(config.option.start_backoff)
+    except ValueError:
+        raise pytest.UsageError('--startbackoff must be a number of seconds.')
+    http_session.configure(config.option.http_pool_size,
+                           config.option.http_timeout)
+    config._session_pool = SessionPool(config.option.max_reuse, config.option.max_idle)
+    config._screenshot_processor = screenshots.ScreenshotProcessor(
+        config.option.screenshot_workers, config.option.screenshot_max_size)
+    # guards state that is set up by the first test to need it
+    config._webqa_lock = threading.RLock()
+    config._circuit_breaker = grid.CircuitBreaker(config.option.max_start_failures)
+    config._session_slots = None
+    if config.option.max_sessions:
+        # the slaves lock slots in the directory created by the master
+        directory = getattr(config, 'slaveinput', {}).get('session_slots')
+        if directory is None:
+            directory = config._session_slots_directory = tempfile.mkdtemp()
+        config._session_slots = grid.SessionSlots(directory, config.option.max_sessions)
+    if config.option.storm_threshold:
+        config._failure_storm = FailureStorm(
+            config.option.storm_threshold, config.option.storm_sample)
+
+    if config.option.sauce_labs_credentials_file:
+        import sauce_labs
+        config._sauce_labs_reporter = sauce_labs.ResultReporter()
+
     if not hasattr(config, 'slaveinput'):
 
         config.addinivalue_line(
@@ -23,11 +79,30 @@ def pytest_configure(config):
             'present. This reduces the risk of running destructive tests ' \
             'accidentally.')
 
+        config.addinivalue_line(
+            'markers', 'fresh_browser: always start a new browser for the ' \
+            'test instead of reusing an idle one, and do not reuse it ' \
+            'afterwards.')
+
+        config.addinivalue_line(
+            'markers', 'browser_scope(scope): share the browser between ' \
+            'nondestructive tests within the given scope (function, ' \
+            'class, module or session). Overrides --browserscope.')
+
+        if config.pluginmanager.hasplugin('xdist'):
+            config.pluginmanager.register(XdistHooks(), '_webqa_xdist')
+
         if config.option.webqa_report_path:
             from html_report import HTMLReport
             config._html = HTMLReport(config)
             config.pluginmanager.register(config._html)
 
+        path = history.history_path(config.option)
+        if path:
+            config._history = history.HistoryReport(
+                path, config.option.build, history.browser_configuration(config.option))
+            config.pluginmanager.register(config._history)
+
         if not config.option.run_destructive:
             if config.option.markexpr:
                 config.option.markexpr = 'nondestructive and (%s)' % config.option.markexpr
@@ -36,16 +111,64 @@ def pytest_configure(config):
 
 
 def pytest_unconfigure(config):
+    pool = getattr(config, '_session_pool', None)
+    if pool:
+        del config._session_pool
+        pool.clear()
+    http_session.close()
+
+    xdist_hooks = config.pluginmanager.getplugin('_webqa_xdist')
+    if xdist_hooks:
+        config.pluginmanager.unregister(xdist_hooks)
+
     html = getattr(config, '_html', None)
     if html:
         del config._html
         config.pluginmanager.unregister(html)
 
+    history_report = getattr(config, '_history', None)
+    if history_report:
+        del config._history
+        config.pluginmanager.unregister(history_report)
+
+    directory = getattr(config, '_session_slots_directory', None)
+    if directory:
+        del config._session_slots_directory
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.mark.trylast
+def pytest_collection_modifyitems(config, items):
+    '''
+        Keeps only the tests in this shard with --shards, and orders the
+        tests by how long they have taken before with --longestfirst, once
+        any other tests have been deselected.
+    '''
+    shards = config.option.shards
+    if not (config.option.longest_first or shards > 1):
+        return
+    path = history.history_path(config.option)
+    estimates = path and history.estimates(path) or {}
+    if shards > 1:
+        if not 1 <= config.option.shard <= shards:
+            raise pytest.UsageError('--shard must be between 1 and %i.' % shards)
+        plan = history.plan_shards(
+            [item.nodeid for item in items], estimates, shards)
+        selected = set(plan[config.option.shard - 1])
+        deselected = [item for item in items if item.nodeid not in selected]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = [item for item in items if item.nodeid in selected]
+    if config.option.longest_first:
+        order = dict((nodeid, i) for i, nodeid in enumerate(history.longest_first(
+            [item.nodeid for item in items], estimates)))
+        items.sort(key=lambda item: order[item.nodeid])
+
 
 def pytest_sessionstart(session):
     if session.config.option.base_url and not (session.config.option.skip_url_check or session.config.option.collectonly):
-        r = requests.get(session.config.option.base_url, verify=False)
-        assert r.status_code in (200, 401), 'Base URL did not return status code 200 or 401. (URL: %s, Response: %s)' % (session.config.option.base_url, r.status_code)
+        status_code = _check_base_url(session.config)['status_code']
+        assert status_code in (200, 401), 'Base URL did not return status code 200 or 401. (URL: %s, Response: %s)' % (session.config.option.base_url, status_code)
 
     # configure session proxies
     if hasattr(session.config, 'browsermob_session_proxy'):
@@ -60,105 +183,240 @@ def pytest_sessionstart(session):
         session.config.option.proxy_port = session.config.option.zap_port
 
 
+@pytest.mark.tryfirst
+def pytest_runtestloop(session):
+    '''
+        Runs nondestructive tests that start their own browser on a pool of
+        threads when --webqathreads is more than one, and any other tests
+        one at a time before them.
+    '''
+    config = session.config
+    if config.option.webqa_threads < 2 or config.option.collectonly or \
+            hasattr(config, 'slaveinput') or getattr(config.option, 'dist', 'no') != 'no' or \
+            hasattr(config, 'browsermob_test_proxy'):
+        return None
+    threaded = [item for item in session.items if _threadable(item)]
+    serial = [item for item in session.items if not _threadable(item)]
+    # the last of the serial tests is followed by the first threaded one, so
+    # that the fixtures they share are kept
+    following = serial[1:] + threaded[:1] + [None]
+    for item, nextitem in zip(serial, following):
+        item.config.hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+        if session.shouldstop:
+            raise session.Interrupted(session.shouldstop)
+    ThreadedRunner(session, config.option.webqa_threads).run(threaded)
+    return True
+
+
+def _threadable(item):
+    # tests sharing a browser must run one at a time, as must tests using
+    # parametrized fixtures, which are torn down when the parameter changes
+    # from one test to the next
+    return 'nondestructive' in item.keywords and \
+        'skip_selenium' not in item.keywords and \
+        'browser_scope' not in item.keywords and \
+        item.config.option.browser_scope == 'function' and \
+        not getattr(getattr(item, 'callspec', None), 'params', None)
+
+
+def pytest_sessionfinish(session):
+    session.config._screenshot_processor.flush()
+    reporter = getattr(session.config, '_sauce_labs_reporter', None)
+    if reporter:
+        reporter.flush(session.config.option.webqatimeout)
+        if hasattr(session.config, 'slaveoutput'):
+            # the master reports the results sent by every slave
+            session.config.slaveoutput['sauce_labs_results'] = (
+                reporter.delivered, reporter.dropped)
+
+
+def pytest_terminal_summary(terminalreporter):
+    storm = getattr(terminalreporter.config, '_failure_storm', None)
+    if storm and storm.storm:
+        terminalreporter.write_line(
+            'Failure storm detected: %s' % storm.describe(storm.storm))
+    reporter = getattr(terminalreporter.config, '_sauce_labs_reporter', None)
+    if reporter and (reporter.delivered or reporter.dropped):
+        terminalreporter.write_line(
+            'Sauce Labs job results: %i sent, %i dropped' % (
+                reporter.delivered, reporter.dropped))
+
+
 def pytest_runtest_setup(item):
     item.debug = {
         'urls': [],
         'screenshots': [],
         'html': [],
         'logs': [],
-        'network_traffic': []}
-    TestSetup.base_url = item.config.option.base_url
+        'network_traffic': [],
+        'thumbnails': [],
+        'timed_out': []}
+    # time (in seconds) spent in each phase of the test
+    item.timings = {}
+    # everything the mozwebqa funcarg gives the test belongs to the item
+    mozwebqa = item.mozwebqa = TestSetup(item.config.option)
 
     # configure test proxies
     if hasattr(item.config, 'browsermob_test_proxy'):
         item.config.option.proxy_host = item.config.option.bmp_host
         item.config.option.proxy_port = item.config.browsermob_test_proxy.port
 
-    # consider this environment sensitive if the base url or any redirection
-    # history matches the regular expression
-    sensitive = False
-    if TestSetup.base_url and not item.config.option.skip_url_check:
-        r = requests.get(TestSetup.base_url, verify=False)
-        urls = [h.url for h in r.history] + [r.url]
-        matches = [re.search(item.config.option.sensitive_url, u) for u in urls]
-        sensitive = any(matches)
+    sensitive_url = None
+    if mozwebqa.base_url and not item.config.option.skip_url_check:
+        sensitive_url = _check_base_url(item.config)['sensitive_url']
 
     destructive = 'nondestructive' not in item.keywords
 
-    if (sensitive and destructive):
-        first_match = matches[next(i for i, match in enumerate(matches) if match)]
-
+    if (sensitive_url and destructive):
         # skip the test with an appropriate message
         py.test.skip('This test is destructive and the target URL is ' \
                      'considered a sensitive environment. If this test is ' \
                      'not destructive, add the \'nondestructive\' marker to ' \
-                     'it. Sensitive URL: %s' % first_match.string)
+                     'it. Sensitive URL: %s' % sensitive_url)
 
     if item.config.option.sauce_labs_credentials_file:
         item.sauce_labs_credentials = credentials.read(item.config.option.sauce_labs_credentials_file)
 
     if item.config.option.credentials_file:
-        TestSetup.credentials = credentials.read(item.config.option.credentials_file)
+        mozwebqa.credentials = credentials.read(item.config.option.credentials_file)
 
-    test_id = '.'.join(split_class_and_test_names(item.nodeid))
+    storm = getattr(item.config, '_failure_storm', None)
+    if 'skip_selenium' not in item.keywords and storm and storm.storm and \
+       item.config.option.storm_abort:
+        pytest.fail('Not starting a browser as a failure storm was detected ' \
+                    '(%s). Remaining tests will fail without running.' % \
+                    storm.describe(storm.storm), pytrace=False)
 
     if 'skip_selenium' not in item.keywords:
-        if hasattr(item, 'sauce_labs_credentials'):
-            from sauce_labs import Client
-            TestSetup.selenium_client = Client(
-                test_id,
-                item.config.option,
-                item.keywords,
-                item.sauce_labs_credentials)
-        else:
-            from selenium_client import Client
-            TestSetup.selenium_client = Client(
-                test_id,
-                item.config.option)
-        TestSetup.selenium_client.start()
-        item.session_id = TestSetup.selenium_client.session_id
-        TestSetup.selenium = TestSetup.selenium_client.selenium
-        TestSetup.timeout = TestSetup.selenium_client.timeout
-        TestSetup.default_implicit_wait = TestSetup.selenium_client.default_implicit_wait
+        client = _create_client(
+            item, getattr(item, 'sauce_labs_credentials', None))
+        pool = item.config._session_pool
+        scope = _browser_scope(item, client)
+        if scope is not None and scope not in pool.scoped:
+            item.session._setupstate.addfinalizer(
+                lambda: pool.end_scope(scope), scope)
+        _check_grid(item, getattr(item, 'sauce_labs_credentials', None))
+        start = timer()
+        try:
+            claimed = pool.claim(item.nodeid)
+            mozwebqa.selenium_client = claimed or pool.acquire(
+                client,
+                fresh='fresh_browser' in item.keywords,
+                scope=scope)
+        except Exception, e:
+            item.hub_starts = client.hub_starts
+            item.config._circuit_breaker.failure(e)
+            raise
+        item.config._circuit_breaker.success()
+        # only browsers started for this test count towards the hub starts
+        started = claimed or mozwebqa.selenium_client is client
+        item.hub_starts = started and mozwebqa.selenium_client.hub_starts or []
+        item.hub = mozwebqa.selenium_client.hub and mozwebqa.selenium_client.hub.address
+        # browsers that were already running, or started in the background,
+        # did not wait for capacity during this test
+        capacity_wait = mozwebqa.selenium_client is client and client.capacity_wait or 0
+        item.timings['queue'] = capacity_wait
+        item.timings['start'] = timer() - start - capacity_wait
+        _prewarm(item)
+        item.session_id = mozwebqa.selenium_client.session_id
+        mozwebqa.selenium = mozwebqa.selenium_client.selenium
+        mozwebqa.timeout = mozwebqa.selenium_client.timeout
+        mozwebqa.default_implicit_wait = mozwebqa.selenium_client.default_implicit_wait
     else:
-        TestSetup.timeout = item.config.option.webqatimeout
-        TestSetup.selenium = None
+        # browsers started for the tests that follow are still needed, but
+        # do not hold on to any others while tests that do not need them run
+        pool = item.config._session_pool
+        if pool.warming:
+            upcoming = _upcoming_items(item, item.config.option.prewarm)
+            pool.discard(keep=[upcoming_item.nodeid for upcoming_item in upcoming])
 
 
 def pytest_runtest_teardown(item):
-    if hasattr(TestSetup, 'selenium') and TestSetup.selenium and 'skip_selenium' not in item.keywords:
-        TestSetup.selenium_client.stop()
+    # the test may have been skipped before claiming its browser
+    item.config._session_pool.discard(item.nodeid)
+    mozwebqa = getattr(item, 'mozwebqa', None)
+    if mozwebqa and mozwebqa.selenium and 'skip_selenium' not in item.keywords:
+        start = timer()
+        item.config._session_pool.release(
+            mozwebqa.selenium_client,
+            fresh='fresh_browser' in item.keywords,
+            scope=_browser_scope(item, mozwebqa.selenium_client))
+        item.timings['quit'] = timer() - start
 
 
 def pytest_runtest_makereport(__multicall__, item, call):
     report = __multicall__.execute()
+    timings = getattr(item, 'timings', {})
     if report.when == 'call':
+        timings['body'] = call.stop - call.start
         report.session_id = getattr(item, 'session_id', None)
-        if hasattr(TestSetup, 'selenium') and TestSetup.selenium and not 'skip_selenium' in item.keywords:
+        mozwebqa = getattr(item, 'mozwebqa', None)
+        if mozwebqa and mozwebqa.selenium and not 'skip_selenium' in item.keywords:
             if report.skipped and 'xfail' in report.keywords or report.failed and 'xfail' not in report.keywords:
-                url = TestSetup.selenium_client.url
-                url and item.debug['urls'].append(url)
-                screenshot = TestSetup.selenium_client.screenshot
-                screenshot and item.debug['screenshots'].append(screenshot)
-                html = TestSetup.selenium_client.html
-                html and item.debug['html'].append(html)
-                log = TestSetup.selenium_client.log
-                log and item.debug['logs'].append(log)
+                start = timer()
+                artifacts, timed_out = _capture(item, call, report)
+                artifacts.get('url') and item.debug['urls'].append(artifacts['url'])
+                screenshot = artifacts.get('screenshot')
+                if screenshot:
+                    content = item.config._screenshot_processor.cap(base64.decodestring(screenshot))
+                    written = _write_artifact(item, 'screenshots', content)
+                    _write_thumbnail(item, written)
+                artifacts.get('html') and _write_artifact(item, 'html', artifacts['html'])
+                # log may contain passwords, etc so we only keep it for tests marked as public
+                if 'public' in item.keywords:
+                    artifacts.get('log') and _write_artifact(item, 'logs', artifacts['log'])
+                artifacts.get('network_traffic') and _write_artifact(
+                    item, 'network_traffic', artifacts['network_traffic'])
+                item.debug['timed_out'] = timed_out
+                timings['capture'] = timer() - start
                 report.sections.append(('pytest-mozwebqa', _debug_summary(item.debug)))
-            network_traffic = TestSetup.selenium_client.network_traffic
-            network_traffic and item.debug['network_traffic'].append(network_traffic)
+            else:
+                network_traffic = mozwebqa.selenium_client.network_traffic
+                network_traffic and _write_artifact(item, 'network_traffic', network_traffic)
             report.debug = item.debug
             if hasattr(item, 'sauce_labs_credentials') and report.session_id:
                 result = {'passed': report.passed or (report.failed and 'xfail' in report.keywords)}
                 import sauce_labs
-                sauce_labs.Job(report.session_id).send_result(
+                item.config._sauce_labs_reporter.send(
+                    sauce_labs.Job(report.session_id),
                     result,
                     item.sauce_labs_credentials)
+    report.timings = dict(timings)
+    report.hub = getattr(item, 'hub', None)
+    if report.when == 'setup':
+        report.hub_starts = getattr(item, 'hub_starts', [])
     return report
 
 
+def _capture(item, call, report):
+    names = ('url', 'screenshot', 'html', 'log', 'network_traffic')
+    options = item.config.option
+    # the deadline covers everything captured for the failure
+    end = timer() + options.capture_deadline
+
+    def capture(names):
+        remaining = end - timer()
+        if remaining <= 0:
+            return ({}, list(names))
+        return item.mozwebqa.selenium_client.capture(
+            names, options.capture_timeout, remaining)
+    storm = getattr(item.config, '_failure_storm', None)
+    if not (storm and report.failed):
+        return capture(names)
+    # the failing URL is part of the fingerprint so is captured first, and
+    # the rest are only captured for a sample of failures during a storm
+    artifacts, timed_out = capture(names[:1])
+    if storm.record(storm.fingerprint(call.excinfo, artifacts.get('url'))):
+        more_artifacts, more_timed_out = capture(names[1:])
+        artifacts.update(more_artifacts)
+        timed_out.extend(more_timed_out)
+    return (artifacts, timed_out)
+
+
 def pytest_funcarg__mozwebqa(request):
-    return TestSetup(request)
+    mozwebqa = request.node.mozwebqa
+    mozwebqa.request = request
+    return mozwebqa
 
 
 def pytest_addoption(parser):
@@ -180,6 +438,86 @@ def pytest_addoption(parser):
                      dest='skip_url_check',
                      default=False,
                      help='skip the base url and sensitivity checks. (default: %default)')
+    group._addoption('--urlcheckinterval',
+                     action='store',
+                     type='int',
+                     dest='url_check_interval',
+                     default=0,
+                     metavar='num',
+                     help='interval (in seconds) after which the base url and sensitivity checks are repeated. 0 checks once per session. (default: %default)')
+    group._addoption('--skipgridcheck',
+                     action='store_true',
+                     dest='skip_grid_check',
+                     default=False,
+                     help='skip checking that the selenium server is up before starting the first browser. (default: %default)')
+    group._addoption('--gridchecktimeout',
+                     action='store',
+                     type='int',
+                     dest='grid_check_timeout',
+                     default=10,
+                     metavar='num',
+                     help='timeout (in seconds) for checking that the selenium server is up. (default: %default)')
+    group._addoption('--maxstartfailures',
+                     action='store',
+                     type='int',
+                     dest='max_start_failures',
+                     default=0,
+                     metavar='num',
+                     help='number of browsers in a row failing to start after which the remaining tests fail without starting one. 0 always tries. (default: %default)')
+    group._addoption('--maxsessions',
+                     action='store',
+                     type='int',
+                     dest='max_sessions',
+                     default=0,
+                     metavar='num',
+                     help='maximum number of browsers open at once, shared by pytest-xdist slaves. 0 is unlimited. (default: %default)')
+    group._addoption('--sessionslottimeout',
+                     action='store',
+                     type='int',
+                     dest='session_slot_timeout',
+                     default=300,
+                     metavar='num',
+                     help='time (in seconds) to wait for another browser to close when --maxsessions are open before failing the test. 0 waits without limit. (default: %default)')
+    group._addoption('--startretries',
+                     action='store',
+                     type='int',
+                     dest='start_retries',
+                     default=3,
+                     metavar='num',
+                     help='number of times to retry starting a browser when the selenium server has no capacity. (default: %default)')
+    # newer versions of pytest only support int and string options
+    group._addoption('--startbackoff',
+                     action='store',
+                     dest='start_backoff',
+                     default='5',
+                     metavar='num',
+                     help='time (in seconds) to wait before first retrying to start a browser, doubling for each retry. (default: %default)')
+    group._addoption('--webqathreads',
+                     action='store',
+                     type='int',
+                     dest='webqa_threads',
+                     default=0,
+                     metavar='num',
+                     help='number of threads running nondestructive browser tests at the same time in this process. (default: %default)')
+    group._addoption('--longestfirst',
+                     action='store_true',
+                     dest='longest_first',
+                     default=False,
+                     help='run the tests that have taken longest in previous runs first. (default: %default)')
+    group._addoption('--shards',
+                     action='store',
+                     type='int',
+                     dest='shards',
+                     default=0,
+                     metavar='num',
+                     help='split the tests into this many shards taking about the same time in previous runs, and only run the one given by --shard. (default: %default)')
+    group._addoption('--shard',
+                     action='store',
+                     type='int',
+                     dest='shard',
+                     default=1,
+                     metavar='num',
+                     help='shard of the tests to run, from 1 to --shards. (default: %default)')
     group._addoption('--api',
                      action='store',
                      default=config.get('DEFAULT', 'api'),
@@ -196,6 +534,11 @@ def pytest_addoption(parser):
                      default=4444,
                      metavar='num',
                      help='port that selenium server is listening on. (default: %default)')
+    group._addoption('--hub',
+                     action='append',
+                     dest='hubs',
+                     metavar='str',
+                     help='selenium server to start browsers on, as host:port or host:port:capacity. can be given more than once to spread browsers across several servers, in place of --host and --port.')
     group._addoption('--driver',
                      action='store',
                      dest='driver',
@@ -227,6 +570,11 @@ def pytest_addoption(parser):
                      dest='profile_path',
                      metavar='str',
                      help='path to the firefox profile to use (webdriver).')
+    group._addoption('--profilecache',
+                     action='store',
+                     dest='profile_cache',
+                     metavar='path',
+                     help='directory to keep built firefox profiles in between runs (webdriver).')
     group._addoption('--extension',
                      action='append',
                      dest='extension_paths',
@@ -272,11 +620,85 @@ def pytest_addoption(parser):
                      default=60,
                      metavar='num',
                      help='timeout (in seconds) for page loads, etc. (default: %default)')
+    group._addoption('--maxreuse',
+                     action='store',
+                     type='int',
+                     dest='max_reuse',
+                     default=1,
+                     metavar='num',
+                     help='maximum number of tests to run in a browser session before starting a new one. 0 reuses sessions without limit. (default: %default)')
+    group._addoption('--maxidle',
+                     action='store',
+                     type='int',
+                     dest='max_idle',
+                     default=5,
+                     metavar='num',
+                     help='maximum number of idle browsers to keep for reuse. Those idle for longest are stopped first. (default: %default)')
+    group._addoption('--browserscope',
+                     action='store',
+                     dest='browser_scope',
+                     default='function',
+                     metavar='str',
+                     help="share the browser between nondestructive tests within this scope. 'function', 'class', 'module' or 'session'. (default: %default)")
+    group._addoption('--prewarm',
+                     action='store',
+                     type='int',
+                     dest='prewarm',
+                     default=0,
+                     metavar='num',
+                     help='number of upcoming tests to start new browsers for in the background while the current test runs. (default: %default)')
+    group._addoption('--httppoolsize',
+                     action='store',
+                     type='int',
+                     dest='http_pool_size',
+                     default=10,
+                     metavar='num',
+                     help='number of connections to keep alive to each host, such as the selenium server. (default: %default)')
+    group._addoption('--httptimeout',
+                     action='store',
+                     type='int',
+                     dest='http_timeout',
+                     default=0,
+                     metavar='num',
+                     help='timeout (in seconds) for requests to the selenium server and other hosts. 0 waits indefinitely. (default: %default)')
     group._addoption('--capturenetwork',
                      action='store_true',
                      dest='capture_network',
                      default=False,
                      help='capture network traffic to test_method_name.json (selenium rc). (default: %default)')
+    group._addoption('--capturetimeout',
+                     action='store',
+                     type='int',
+                     dest='capture_timeout',
+                     default=30,
+                     metavar='num',
+                     help='timeout (in seconds) for capturing each of the screenshot, html, etc. on failure. (default: %default)')
+    group._addoption('--capturedeadline',
+                     action='store',
+                     type='int',
+                     dest='capture_deadline',
+                     default=60,
+                     metavar='num',
+                     help='maximum time (in seconds) to spend capturing the screenshot, html, etc. on failure. (default: %default)')
+    group._addoption('--stormthreshold',
+                     action='store',
+                     type='int',
+                     dest='storm_threshold',
+                     default=0,
+                     metavar='num',
+                     help='number of tests failing with the same exception, message and url after which only a sample of the failures are captured. 0 captures every failure. (default: %default)')
+    group._addoption('--stormsample',
+                     action='store',
+                     type='int',
+                     dest='storm_sample',
+                     default=10,
+                     metavar='num',
+                     help='capture one in this many failures once --stormthreshold has been reached. (default: %default)')
+    group._addoption('--stormabort',
+                     action='store_true',
+                     dest='storm_abort',
+                     default=False,
+                     help='fail the remaining selenium tests without running them once --stormthreshold has been reached. (default: %default)')
     group._addoption('--build',
                      action='store',
                      dest='build',
@@ -330,6 +752,25 @@ def pytest_addoption(parser):
                     metavar='path',
                     default='results/index.html',
                     help='create mozilla webqa custom report file at given path. (default: %default)')
+    group.addoption('--webqahistory',
+                    action='store',
+                    dest='webqa_history_path',
+                    metavar='path',
+                    help='sqlite database keeping the outcome and duration of tests between runs. (default: history.sqlite alongside --webqareport)')
+    group.addoption('--screenshotmaxsize',
+                    action='store',
+                    type='int',
+                    dest='screenshot_max_size',
+                    default=0,
+                    metavar='num',
+                    help='scale down failure screenshots wider or taller than this many pixels. 0 keeps them full size. (default: %default)')
+    group.addoption('--screenshotworkers',
+                    action='store',
+                    type='int',
+                    dest='screenshot_workers',
+                    default=2,
+                    metavar='num',
+                    help='number of background threads writing screenshot thumbnails. 0 writes them before the test finishes. (default: %default)')
 
 
 def split_class_and_test_names(nodeid):
@@ -342,16 +783,245 @@ def split_class_and_test_names(nodeid):
     return (classname, name)
 
 
+def _check_base_url(config):
+    '''
+        Requests the base url at most once per --urlcheckinterval, and
+        returns its status code, redirection history and the first url in
+        that history that is considered sensitive.
+    '''
+    check = getattr(config, '_base_url_check', None)
+    if check is None and hasattr(config, 'slaveinput'):
+        check = config.slaveinput.get('base_url_check')
+    interval = config.option.url_check_interval
+    if check is None or (interval and time.time() - check['time'] > interval):
+        r = http_session.get(config.option.base_url, verify=False)
+        urls = [h.url for h in r.history] + [r.url]
+        # consider this environment sensitive if the base url or any
+        # redirection history matches the regular expression
+        sensitive_urls = [u for u in urls if re.search(config.option.sensitive_url, u)]
+        check = {
+            'time': time.time(),
+            'status_code': r.status_code,
+            'urls': urls,
+            'sensitive_url': sensitive_urls and sensitive_urls[0] or None}
+    config._base_url_check = check
+    return check
+
+
+def _check_grid(item, sauce_labs_credentials=None):
+    '''
+        Checks that the selenium server is up the first time a test needs a
+        browser, and fails the test without starting a browser if it is not,
+        or if too many browsers in a row have failed to start.
+    '''
+    config = item.config
+    with config._webqa_lock:
+        if not hasattr(config, '_grid_status'):
+            scheduler = not sauce_labs_credentials and config._hub_scheduler
+            if config.option.skip_grid_check:
+                config._grid_status = None
+            elif scheduler:
+                # hubs that are down are not used
+                config._grid_status = scheduler.check(config.option.grid_check_timeout)
+            else:
+                url = grid.status_url(config.option, sauce_labs_credentials)
+                config._grid_status = url and \
+                    grid.check_status(url, config.option.grid_check_timeout) or None
+    reason = config._grid_status or config._circuit_breaker.reason()
+    if reason:
+        pytest.fail(reason, pytrace=False)
+
+
+def _create_client(item, sauce_labs_credentials=None):
+    test_id = '.'.join(split_class_and_test_names(item.nodeid))
+    return _launch_plan(item, sauce_labs_credentials).clone(
+        test_id, item.config.option, item.keywords)
+
+
+def _launch_plan(item, sauce_labs_credentials=None):
+    '''
+        Resolves and validates the launch configuration the first time a
+        test needs a browser. Every other browser is launched from a clone.
+    '''
+    with item.config._webqa_lock:
+        return _resolve_launch_plan(item, sauce_labs_credentials)
+
+
+def _resolve_launch_plan(item, sauce_labs_credentials):
+    plan = getattr(item.config, '_launch_plan', None)
+    if plan is None:
+        try:
+            if sauce_labs_credentials:
+                from sauce_labs import Client
+                plan = Client(
+                    None,
+                    item.config.option,
+                    item.keywords,
+                    sauce_labs_credentials)
+            else:
+                from selenium_client import Client
+                plan = Client(
+                    None,
+                    item.config.option)
+            plan.check_usage()
+        except pytest.UsageError, e:
+            # every other test would fail in the same way
+            item.session.shouldstop = str(e)
+            raise
+        plan.session_slots = item.config._session_slots
+        if not sauce_labs_credentials:
+            plan.hub_scheduler = item.config._hub_scheduler
+        item.config._launch_plan = plan
+    return plan
+
+
+def _prewarm(item):
+    '''
+        Starts browsers in the background for the upcoming tests that will
+        need a new one, so that they are ready by the time those tests run.
+    '''
+    depth = item.config.option.prewarm
+    # the upcoming tests are not known when distributing tests, and test
+    # proxies are only configured when each test starts
+    if not depth or hasattr(item.config, 'slaveinput') or \
+            hasattr(item.config, 'browsermob_test_proxy') or \
+            item.config.option.webqa_threads > 1:
+        return
+
+    pool = item.config._session_pool
+    for upcoming in _upcoming_items(item, depth):
+        if 'skip_selenium' in upcoming.keywords or upcoming.nodeid in pool.warming:
+            continue
+        client = _create_client(upcoming, getattr(item, 'sauce_labs_credentials', None))
+        try:
+            shared = _browser_scope(upcoming, client) is not None
+        except pytest.UsageError:
+            # reported when the upcoming test runs
+            continue
+        if 'fresh_browser' in upcoming.keywords or \
+                (pool.max_reuse == 1 and not shared):
+            # a slot may only be freed once a later test has claimed its
+            # browser, so waiting for one in the background could hang
+            if not client.reserve_slot():
+                break
+            pool.prewarm(upcoming.nodeid, client)
+
+
+def _upcoming_items(item, count):
+    session = item.session
+    if not hasattr(session, '_item_index'):
+        session._item_index = dict(
+            (i.nodeid, index) for index, i in enumerate(session.items))
+    index = session._item_index[item.nodeid]
+    return session.items[index + 1:index + 1 + count]
+
+
+def _browser_scope(item, client):
+    '''
+        Returns the collection node that owns the browser for this test, or
+        None if the browser belongs to the test alone.
+    '''
+    scope = item.config.option.browser_scope
+    if 'browser_scope' in item.keywords:
+        scope = item.keywords['browser_scope'].args[0]
+    if scope not in BROWSER_SCOPES:
+        raise pytest.UsageError(
+            "browser scope must be one of: %s." % ', '.join(sorted(BROWSER_SCOPES)))
+
+    # destructive tests may leave the application in any state, so they
+    # never share a browser with other tests
+    if not BROWSER_SCOPES[scope] or not client.reusable or \
+            'nondestructive' not in item.keywords or \
+            'fresh_browser' in item.keywords:
+        return None
+    return item.getparent(BROWSER_SCOPES[scope])
+
+
+def _write_artifact(item, key, content):
+    '''
+        Writes a failure artifact to the debug directory alongside the report
+        as soon as it is captured, so that only its path and size are kept.
+        Artifacts are named after a hash of their content, so identical
+        artifacts captured by many tests (such as the same error page) are
+        only stored once. Returns whether the artifact was written.
+    '''
+    if not item.config.option.webqa_report_path:
+        return False
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    logfile = html_report.report_path(item.config.option.webqa_report_path)
+    extension = os.path.splitext(dict((k, f) for k, f, n in html_report.ARTIFACTS)[key])[1]
+    (relative_path, full_path) = html_report.artifact_paths(
+        logfile, hashlib.sha1(content).hexdigest() + extension)
+    item.debug[key].append({'path': relative_path, 'size': len(content)})
+    if os.path.exists(full_path):
+        return False
+    # write to a temporary file first so that other processes never see a
+    # partially written artifact
+    fd, path = tempfile.mkstemp(dir=os.path.dirname(full_path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.chmod(path, 0644)
+    os.rename(path, full_path)
+    return True
+
+
+def _write_thumbnail(item, process=True):
+    '''
+        Queues the latest screenshot to be scaled down and have a thumbnail
+        written alongside it, which happens in the background. Screenshots
+        that were already stored share the existing thumbnail.
+    '''
+    processor = item.config._screenshot_processor
+    if not (item.debug['screenshots'] and processor.enabled):
+        return
+    root_path = os.path.dirname(html_report.report_path(item.config.option.webqa_report_path))
+    path = item.debug['screenshots'][-1]['path']
+    relative_path = '%s-thumbnail.png' % os.path.splitext(path)[0]
+    if process:
+        processor.submit(os.path.join(root_path, path), os.path.join(root_path, relative_path))
+    item.debug['thumbnails'].append({'path': relative_path})
+
+
 def _debug_summary(debug):
     summary = []
     if debug['urls']:
         summary.append('Failing URL: %s' % debug['urls'][-1])
+    if debug.get('timed_out'):
+        summary.append('Timed out capturing: %s' % ', '.join(debug['timed_out']))
     return '\n'.join(summary)
 
 
+class XdistHooks(object):
+    '''
+        Hooks that are only known when pytest-xdist is installed
+    '''
+
+    def pytest_configure_node(self, node):
+        # share the base url check with the slaves
+        option = node.config.option
+        if option.base_url and not option.skip_url_check:
+            node.slaveinput['base_url_check'] = _check_base_url(node.config)
+        if option.max_sessions:
+            node.slaveinput['session_slots'] = node.config._session_slots_directory
+
+    def pytest_testnodedown(self, node, error):
+        reporter = getattr(node.config, '_sauce_labs_reporter', None)
+        results = getattr(node, 'slaveoutput', {}).get('sauce_labs_results')
+        if reporter and results:
+            reporter.add(*results)
+
+
 class TestSetup:
     '''
-        This class is just used for monkey patching
+        The browser, credentials and settings for a single test, returned
+        by the mozwebqa funcarg
     '''
-    def __init__(self, request):
-        self.request = request
+    def __init__(self, options):
+        self.request = None
+        self.base_url = options.base_url
+        self.credentials = None
+        self.selenium_client = None
+        self.selenium = None
+        self.timeout = options.webqatimeout
+        self.default_implicit_wait = None
@@ -1,60 +1,224 @@
+// rows rendered above and below those in view while scrolling
+var ROW_BUFFER = 20;
+var PHASES = ['queue', 'start', 'body', 'capture', 'quit'];
+// lines of a traceback shown before it is expanded
+var LOG_PREVIEW_LINES = 20;
+
+var results = [];
+var visible = [];
+var row_height = 0;
+var sort_column = null;
+var sort_ascending = true;
+
 $(document).ready(function() {
 
-	reset_sort_headers();
+	results = load_results();
 
-	split_debug_onto_two_rows();
+	reset_sort_headers();
 
 	$('.sortable').click(toggle_sort_states);
 
 	$('.sortable').click(function() {
-		var columnName = $(this).attr('col');
-		if ($(this).hasClass('numeric')) {
-			sort_rows_num($(this), 'col-' + columnName);
-		} else {
-		sort_rows_alpha($(this), 'col-' + columnName);
-		}
+		sort_column = $(this).attr('col');
+		sort_ascending = $(this).hasClass('asc');
+		sort_results();
+		render_rows();
+	});
+
+	$('#filters input').change(filter_results);
+	$('#filter-class').keyup(filter_results);
+
+	$('#results-container').scroll(render_rows);
+
+	$('#results-table-body').on('click', 'tr.results-table-row', function() {
+		$('tr.expanded').removeClass('expanded');
+		$(this).addClass('expanded');
+		show_detail(visible[$(this).attr('data-index')]);
 	});
 
+	filter_results();
+
 });
 
-function sort_rows_alpha(clicked, sortclass) {
-	one_row_for_data();
-	var therows = $('.results-table-row');
-	therows.sort(function(s, t) {
-		var a = s.getElementsByClassName(sortclass)[0].innerHTML.toLowerCase();
-		var b = t.getElementsByClassName(sortclass)[0].innerHTML.toLowerCase();
-		if (clicked.hasClass('asc')) {
-			if (a < b)
-				return -1;
-			if (a > b)
-				return 1;
-			return 0;
-		} else {
-			if (a < b)
-				return 1;
-			if (a > b)
-				return -1;
-			return 0;
+function load_results() {
+	// one result per line, the last of which may be incomplete if the
+	// test run has not finished
+	var lines = $('#results-data').text().split('\n');
+	var loaded = [];
+	for (var i = 0; i < lines.length; i++) {
+		var result;
+		try {
+			result = $.parseJSON(lines[i]);
+		} catch (e) {
+			continue;
+		}
+		if (!result) {
+			continue;
+		}
+		// sort keys are computed once rather than in every comparison
+		result.keys = {
+			'result': result.result.toLowerCase(),
+			'class': result['class'].toLowerCase(),
+			'name': result.name.toLowerCase(),
+			'duration': result.duration
+		};
+		for (var j = 0; j < PHASES.length; j++) {
+			result.keys[PHASES[j]] = result.timings[j];
 		}
+		loaded.push(result);
+	}
+	return loaded;
+}
+
+function filter_results() {
+	var outcomes = {};
+	$('#filters input.outcome:checked').each(function() {
+		outcomes[$(this).val()] = true;
+	});
+	var text = ($('#filter-class').val() || '').toLowerCase();
+	visible = [];
+	for (var i = 0; i < results.length; i++) {
+		var result = results[i];
+		if (outcomes[result.keys.result] && result.keys['class'].indexOf(text) != -1) {
+			visible.push(result);
+		}
+	}
+	sort_results();
+	render_rows();
+}
+
+function sort_results() {
+	if (!sort_column) {
+		return;
+	}
+	var column = sort_column;
+	var direction = sort_ascending ? 1 : -1;
+	visible.sort(function(s, t) {
+		var a = s.keys[column];
+		var b = t.keys[column];
+		if (a < b)
+			return -direction;
+		if (a > b)
+			return direction;
+		return 0;
 	});
-	$('#results-table-body').append(therows);
-	split_debug_onto_two_rows();
 }
 
-function sort_rows_num(clicked, sortclass) {
-	one_row_for_data();
-	var therows = $('.results-table-row');
-	therows.sort(function(s, t) {
-		var a = s.getElementsByClassName(sortclass)[0].innerHTML
-		var b = t.getElementsByClassName(sortclass)[0].innerHTML
-		if (clicked.hasClass('asc')) {
-			return a - b;
+function render_rows() {
+	// only the rows in view are added to the page
+	var container = $('#results-container');
+	var height = row_height || 30;
+	var first = Math.max(0, Math.floor(container.scrollTop() / height) - ROW_BUFFER);
+	var last = Math.min(visible.length,
+		Math.ceil((container.scrollTop() + container.height()) / height) + ROW_BUFFER);
+	var rows = [spacer_html(first * height)];
+	for (var i = first; i < last; i++) {
+		rows.push(row_html(visible[i], i));
+	}
+	rows.push(spacer_html((visible.length - last) * height));
+	$('#results-table-body').html(rows.join(''));
+	if (!row_height && last > first) {
+		row_height = $('#results-table-body tr.results-table-row').first().outerHeight();
+		if (row_height) {
+			render_rows();
+		}
+	}
+}
+
+function spacer_html(height) {
+	return '<tr class="spacer" style="height: ' + height + 'px"></tr>';
+}
+
+function row_html(result, index) {
+	var cells = [
+		'<td class="col-result">' + escape_html(result.result) + '</td>',
+		'<td class="col-class">' + escape_html(result['class']) + '</td>',
+		'<td class="col-name">' + escape_html(result.name) + '</td>',
+		'<td class="col-duration">' + result.duration + '</td>'
+	];
+	for (var i = 0; i < PHASES.length; i++) {
+		cells.push('<td class="col-' + PHASES[i] + '">' + result.timings[i].toFixed(2) + '</td>');
+	}
+	cells.push('<td class="col-links">' + links_html(result.links) + '</td>');
+	return '<tr class="' + result.keys.result + ' results-table-row" data-index="' + index + '">' +
+		cells.join('') + '</tr>';
+}
+
+function links_html(links) {
+	var html = [];
+	for (var i = 0; i < links.length; i++) {
+		html.push('<a href="' + escape_html(links[i][1]) + '">' + escape_html(links[i][0]) + '</a>');
+	}
+	return html.join(' ');
+}
+
+function show_detail(result) {
+	var detail = $('#results-detail').empty();
+	if (!result) {
+		return;
+	}
+	detail.append($('<h3>').text(result['class'] + ' :: ' + result.name));
+	detail.append($('<p>').html(links_html(result.links)));
+	// videos, full size screenshots and long tracebacks are only loaded
+	// when asked for
+	if (result.video) {
+		detail.append($('<div class="video">').append(
+			$('<a href="#">Play video</a>').click(function() {
+				$(this).parent().html(result.video);
+				return false;
+			})));
+	}
+	if (result.screenshot) {
+		var screenshot = $('<div class="screenshot">');
+		var show = $('<span>Show screenshot</span>');
+		if (result.thumbnail) {
+			// thumbnails are written in the background, so may be missing
+			show = $('<img>').error(function() {
+				$(this).replaceWith('<span>Show screenshot</span>');
+			}).attr('src', result.thumbnail);
+		}
+		screenshot.append($('<a>').attr('href', result.screenshot).append(show).click(function() {
+			$(this).replaceWith($('<a>').attr('href', result.screenshot).append(
+				$('<img>').attr('src', result.screenshot)));
+			screenshot.addClass('full');
+			return false;
+		}));
+		detail.append(screenshot);
+	}
+	if (result.log) {
+		var log = $('<div class="log">');
+		if (result.log.length > LOG_PREVIEW_LINES) {
+			log.append($('<a href="#">').text(
+				'Show full traceback (' + result.log.length + ' lines)').click(function() {
+				log.replaceWith(log_html(result.log, 0));
+				return false;
+			}));
+			log.append('<br/>');
+			log = log_html(result.log, result.log.length - LOG_PREVIEW_LINES, log);
 		} else {
-			return b - a;
+			log = log_html(result.log, 0, log);
 		}
-	});
-	$('#results-table-body').append(therows);
-	split_debug_onto_two_rows();
+		detail.append(log);
+	}
+}
+
+function log_html(lines, first, log) {
+	log = log || $('<div class="log">');
+	for (var i = first; i < lines.length; i++) {
+		var line = lines[i];
+		if (line.indexOf('E   ') == 0) {
+			log.append($('<span class="error">').text(line));
+		} else {
+			log.append(document.createTextNode(line));
+		}
+		log.append('<br/>');
+	}
+	return log;
+}
+
+function escape_html(text) {
+	return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;')
+		.replace(/>/g, '&gt;').replace(/"/g, '&quot;');
 }
 
 function reset_sort_headers() {
@@ -78,18 +242,3 @@ function toggle_sort_states() {
 		$(this).addClass('active');
 	}
 }
-
-function split_debug_onto_two_rows() {
-	$('tr.results-table-row').each(function() {
-		$('<tr class="debug">').insertAfter(this).append($('.debug', this));
-	});
-	$('td.debug').attr('colspan', 5);
-}
-
-function one_row_for_data() {
-	$('tr.results-table-row').each(function() {
-		if ($(this).next().hasClass('debug')) {
-			$(this).append($(this).next().contents().unwrap());
-		}
-	});
-}
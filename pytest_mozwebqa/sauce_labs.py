@@ -4,8 +4,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import httplib
 import json
+import Queue
+import threading
 
 import ConfigParser
 import pytest
@@ -13,11 +14,17 @@ from py.xml import html
 from selenium import selenium
 from selenium import webdriver
 
+import http_session
 import selenium_client
 
+API_URL = 'http://saucelabs.com/rest/v1'
+
 
 class Client(selenium_client.Client):
 
+    # sauce labs jobs are named and marked as passed or failed per test
+    reusable = False
+
     def __init__(self, test_id, options, keywords, credentials):
         super(Client, self).__init__(test_id, options)
 
@@ -29,6 +36,11 @@ class Client(selenium_client.Client):
         self.build = options.build
         self.credentials = credentials
 
+    def clone(self, test_id, options, keywords):
+        client = super(Client, self).clone(test_id, options, keywords)
+        client.keywords = keywords
+        return client
+
     def check_basic_usage(self):
         super(Client, self).check_basic_usage()
 
@@ -38,6 +50,10 @@ class Client(selenium_client.Client):
         if not self.credentials['api-key']:
             raise pytest.UsageError('api-key must be specified in the sauce labs credentials file.')
 
+    def get_desired_capabilities(self):
+        # sauce labs accepts browser names that selenium has no defaults for
+        return {}
+
     def check_rc_usage(self):
         if not self.browser_name:
             raise pytest.UsageError("--browsername must be specified when using the 'rc' api with sauce labs.")
@@ -64,12 +80,11 @@ class Client(selenium_client.Client):
                              'browserName': self.browser_name})
         if self.browser_version:
             capabilities['version'] = self.browser_version
-        if self.capabilities:
-            capabilities.update(json.loads(self.capabilities))
+        capabilities.update(self.capabilities)
         executor = 'http://%s:%s@ondemand.saucelabs.com:80/wd/hub' % (
             self.credentials['username'],
             self.credentials['api-key'])
-        self.selenium = webdriver.Remote(command_executor=executor,
+        self.selenium = webdriver.Remote(command_executor=http_session.RemoteConnection(executor),
                                          desired_capabilities=capabilities)
 
     def start_rc_client(self):
@@ -135,18 +150,82 @@ class Job(object):
             id='player%s' % self.session_id,
             class_='video')
 
-    def send_result(self, result, credentials):
-        try:
-            basic_authentication = (
-                '%s:%s' % (credentials['username'],
-                           credentials['api-key'])).encode('base64')[:-1]
-            connection = httplib.HTTPConnection('saucelabs.com')
-            connection.request(
-                'PUT',
-                '/rest/v1/%s/jobs/%s' % (credentials['username'], self.session_id),
-                json.dumps(result),
-                headers={'Authorization': 'Basic %s' % basic_authentication,
-                         'Content-Type': 'text/json'})
-            connection.getresponse()
-        except:
-            pass
+    def send_result(self, result, credentials, api_url=API_URL):
+        response = http_session.put(
+            '%s/%s/jobs/%s' % (api_url, credentials['username'], self.session_id),
+            json.dumps(result),
+            auth=(credentials['username'], credentials['api-key']),
+            headers={'Content-Type': 'text/json'})
+        response.raise_for_status()
+
+
+class ResultReporter(object):
+    '''
+        Sends job results to Sauce Labs from a background thread so that
+        tests do not wait for them, retrying any that fail.
+    '''
+
+    def __init__(self, retries=3, backoff=1, api_url=API_URL):
+        self.retries = retries
+        self.backoff = backoff
+        self.api_url = api_url
+        self.delivered = self.dropped = self.pending = 0
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._aborted = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, job, result, credentials):
+        with self._lock:
+            self.pending += 1
+        self._queue.put((job, result, credentials))
+
+    def _run(self):
+        while True:
+            update = self._queue.get()
+            if update is None:
+                return
+            self._deliver(*update)
+
+    def _deliver(self, job, result, credentials):
+        for attempt in range(self.retries + 1):
+            if self._aborted.is_set():
+                return
+            try:
+                job.send_result(result, credentials, self.api_url)
+                self._count('delivered')
+                return
+            except Exception:
+                if attempt < self.retries:
+                    self._aborted.wait(self.backoff * 2 ** attempt)
+        self._count('dropped')
+
+    def _count(self, outcome):
+        with self._lock:
+            # results still pending after a flush have already been dropped
+            if not self._aborted.is_set():
+                self.pending -= 1
+                setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def add(self, delivered, dropped):
+        '''
+            Counts results that were sent elsewhere, such as by the
+            pytest-xdist slaves.
+        '''
+        with self._lock:
+            self.delivered += delivered
+            self.dropped += dropped
+
+    def flush(self, timeout):
+        '''
+            Waits up to timeout seconds for the queued results to be sent.
+            Any that have not been sent by then are dropped.
+        '''
+        self._queue.put(None)
+        self._thread.join(timeout)
+        with self._lock:
+            self._aborted.set()
+            self.dropped += self.pending
+            self.pending = 0
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import Queue
+import StringIO
+import threading
+
+try:
+    from PIL import Image
+except ImportError:
+    # thumbnails are only generated if the Python Imaging Library is installed
+    Image = None
+
+# largest width and height of a thumbnail
+THUMBNAIL_SIZE = (320, 240)
+
+
+class ScreenshotProcessor(object):
+    '''
+        Writes thumbnails of screenshots on a pool of background threads so
+        that tests do not wait for them. Screenshots larger than max_size
+        pixels are scaled down before they are stored, as they are named
+        after a hash of their content.
+    '''
+
+    def __init__(self, workers=2, max_size=0):
+        self.workers = workers
+        self.max_size = max_size
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def submit(self, path, thumbnail_path):
+        if not self.workers:
+            return self.process(path, thumbnail_path)
+        with self._lock:
+            # the workers are only started once there is a screenshot
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        self._queue.put((path, thumbnail_path))
+
+    def _run(self):
+        while True:
+            path, thumbnail_path = self._queue.get()
+            try:
+                self.process(path, thumbnail_path)
+            except Exception:
+                pass
+            finally:
+                self._queue.task_done()
+
+    def cap(self, content):
+        if not self.max_size:
+            return content
+        return cap(content, self.max_size)
+
+    def process(self, path, thumbnail_path):
+        thumbnail(path, thumbnail_path)
+
+    def flush(self):
+        '''
+            Waits for the queued screenshots to be processed.
+        '''
+        self._queue.join()
+
+
+def cap(content, max_size):
+    '''
+        Returns the screenshot content scaled down if its width or height is
+        more than max_size pixels, or unchanged otherwise.
+    '''
+    if Image is None:
+        return content
+    try:
+        image = Image.open(StringIO.StringIO(content))
+        if max(image.size) <= max_size:
+            return content
+        image.thumbnail((max_size, max_size), Image.ANTIALIAS)
+        output = StringIO.StringIO()
+        image.save(output, 'PNG', optimize=True)
+    except IOError:
+        return content
+    return output.getvalue()
+
+
+def thumbnail(path, thumbnail_path, size=THUMBNAIL_SIZE):
+    '''
+        Writes a scaled down copy of the screenshot at path, returning the
+        size of the thumbnail in bytes, or None if it could not be written.
+    '''
+    if Image is None:
+        return None
+    try:
+        image = Image.open(path)
+        image.thumbnail(size, Image.ANTIALIAS)
+        image.save(thumbnail_path, 'PNG', optimize=True)
+    except IOError:
+        return None
+    return os.path.getsize(thumbnail_path)
@@ -4,7 +4,12 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import base64
+import copy
 import json
+import os
+import threading
+from timeit import default_timer as timer
 
 import pytest
 from selenium.webdriver.common.proxy import Proxy
@@ -12,9 +17,26 @@ from selenium.webdriver.firefox.firefox_binary import FirefoxBinary
 from selenium import selenium
 from selenium import webdriver
 
+import grid
+import http_session
+from profile_cache import ProfileCache
+
+
+def _load_json(option, value):
+    try:
+        return json.loads(value or '{}')
+    except ValueError, e:
+        raise pytest.UsageError('%s must be valid JSON. (%s)' % (option, e))
+
 
 class Client(object):
 
+    reusable = True
+    # limits the number of sessions open at once, if set
+    session_slots = None
+    # spreads sessions across several selenium servers, if set
+    hub_scheduler = None
+
     def __init__(self, test_id, options):
         self.test_id = test_id
         self.host = options.host
@@ -27,15 +49,18 @@ class Client(object):
 
         if self.webdriver:
             self.driver = options.driver
-            self.capabilities = options.capabilities
+            self.capabilities = _load_json('--capabilities', options.capabilities)
             self.chrome_path = options.chrome_path
-            self.chrome_options = options.chrome_options or '{}'
+            self.chrome_options = _load_json('--chromeopts', options.chrome_options)
             self.firefox_path = options.firefox_path
-            self.firefox_preferences = options.firefox_preferences
+            self.firefox_preferences = _load_json('--firefoxpref', options.firefox_preferences)
             self.profile_path = options.profile_path
             self.extension_paths = options.extension_paths or []
             self.opera_path = options.opera_path
             self.timeout = options.webqatimeout
+            # shared by every client cloned from this one
+            self.profile_cache = ProfileCache(options.profile_cache)
+            self.chrome_options_cache = {'extensions': {}, 'capabilities': {}}
 
             if self.driver.upper() == 'REMOTE':
                 self.browser_name = options.browser_name
@@ -52,6 +77,28 @@ class Client(object):
         self.assume_untrusted = options.assume_untrusted
         self.proxy_host = options.proxy_host
         self.proxy_port = options.proxy_port
+        self.start_retries = options.start_retries
+        self.start_backoff = options.start_backoff
+        self.session_slot_timeout = options.session_slot_timeout
+        self.slot = None
+        self.hub = None
+        # the hub, time taken and success of each attempt to start a session
+        self.hub_starts = []
+        # time spent waiting for capacity to start the browser
+        self.capacity_wait = 0
+
+    def clone(self, test_id, options, keywords):
+        '''
+            Returns a client for the given test with the same launch
+            configuration, without resolving or validating it again.
+        '''
+        client = copy.copy(self)
+        client.test_id = test_id
+        client.hub_starts = []
+        # test proxies are configured as each test starts
+        client.proxy_host = options.proxy_host
+        client.proxy_port = options.proxy_port
+        return client
 
     def check_usage(self):
         self.check_basic_usage()
@@ -73,12 +120,45 @@ class Client(object):
             if not self.platform:
                 raise pytest.UsageError("--platform must be specified when using the 'webdriver' api.")
 
+            self.desired_capabilities = self.get_desired_capabilities()
+
+    def get_desired_capabilities(self):
+        try:
+            return dict(getattr(webdriver.DesiredCapabilities, self.browser_name.upper()))
+        except AttributeError:
+            valid_browsers = [attr for attr in dir(webdriver.DesiredCapabilities) if not attr.startswith('__')]
+            raise pytest.UsageError("Invalid browser name: '%s'. Valid options are: %s" % (self.browser_name, ', '.join(valid_browsers)))
+
     def check_rc_usage(self):
         if not self.browser:
             raise pytest.UsageError("--browser or --environment must be specified when using the 'rc' api.")
 
     def start(self):
-        self.check_usage()
+        self.capacity_wait = 0
+        self.hub_starts = []
+        # the slot may have been reserved before starting in the background
+        if self.session_slots and not self.slot:
+            self.slot, self.capacity_wait = self.session_slots.acquire(
+                timeout=self.session_slot_timeout)
+        try:
+            waited = grid.start_with_retry(
+                self._start_on_hub, self.start_retries, self.start_backoff)
+        except:
+            self._release_slot()
+            raise
+        self.capacity_wait += waited
+
+    def _start_on_hub(self):
+        '''
+            Starts the browser, returning the time spent waiting for a hub
+            with capacity.
+        '''
+        if self.hub_scheduler:
+            return self.hub_scheduler.start(self, self._start)
+        self._start()
+        return 0
+
+    def _start(self):
         if self.webdriver:
             self.start_webdriver_client()
             self.selenium.implicitly_wait(self.default_implicit_wait)
@@ -87,10 +167,28 @@ class Client(object):
             self.selenium.set_timeout(self.timeout)
             self.selenium.set_context(self.test_id)
 
+    def reserve_slot(self):
+        '''
+            Takes a free session slot for starting the browser later, without
+            waiting for one. Returns whether the browser can be started.
+        '''
+        if self.session_slots and not self.slot:
+            self.slot, wait = self.session_slots.acquire(block=False)
+            return bool(self.slot)
+        return True
+
+    def _release_slot(self):
+        if self.slot:
+            self.session_slots.release(self.slot)
+            self.slot = None
+
+    def _release_hub(self):
+        if self.hub:
+            self.hub_scheduler.release(self.hub)
+            self.hub = None
+
     def start_webdriver_client(self):
-        capabilities = {}
-        if self.capabilities:
-            capabilities.update(json.loads(self.capabilities))
+        capabilities = dict(self.capabilities)
         if self.proxy_host and self.proxy_port:
             proxy = Proxy()
             proxy.http_proxy = '%s:%s' % (self.proxy_host, self.proxy_port)
@@ -99,27 +197,28 @@ class Client(object):
         profile = None
 
         if self.driver.upper() == 'REMOTE':
-            capabilities.update(getattr(webdriver.DesiredCapabilities, self.browser_name.upper()))
-            if json.loads(self.chrome_options) or self.extension_paths:
+            capabilities.update(self.desired_capabilities)
+            if self.chrome_options or self.extension_paths:
                 capabilities = self.create_chrome_options(
                     self.chrome_options,
                     self.extension_paths).to_capabilities()
             if self.browser_name.upper() == 'FIREFOX':
-                profile = self.create_firefox_profile(
-                    self.firefox_preferences,
+                profile = self.profile_cache.get(
+                    lambda: self.create_firefox_profile(
+                        self.firefox_preferences,
+                        self.profile_path,
+                        self.extension_paths),
                     self.profile_path,
-                    self.extension_paths)
+                    self.firefox_preferences,
+                    self.extension_paths,
+                    self.assume_untrusted)
             if self.browser_version:
                 capabilities['version'] = self.browser_version
             capabilities['platform'] = self.platform.upper()
             executor = 'http://%s:%s/wd/hub' % (self.host, self.port)
-            try:
-                self.selenium = webdriver.Remote(command_executor=executor,
-                                                 desired_capabilities=capabilities or None,
-                                                 browser_profile=profile)
-            except AttributeError:
-                valid_browsers = [attr for attr in dir(webdriver.DesiredCapabilities) if not attr.startswith('__')]
-                raise AttributeError("Invalid browser name: '%s'. Valid options are: %s" % (self.browser_name, ', '.join(valid_browsers)))
+            self.selenium = webdriver.Remote(command_executor=http_session.RemoteConnection(executor),
+                                             desired_capabilities=capabilities or None,
+                                             browser_profile=profile)
 
         elif self.driver.upper() == 'CHROME':
             options = None
@@ -162,6 +261,50 @@ class Client(object):
         else:
             self.selenium.start()
 
+    @property
+    def launch_key(self):
+        if self.webdriver:
+            settings = (self.driver,
+                        json.dumps(self.capabilities, sort_keys=True),
+                        self.chrome_path,
+                        json.dumps(self.chrome_options, sort_keys=True),
+                        self.firefox_path,
+                        json.dumps(self.firefox_preferences, sort_keys=True),
+                        self.profile_path,
+                        tuple(self.extension_paths), self.opera_path,
+                        getattr(self, 'browser_name', None),
+                        getattr(self, 'browser_version', None),
+                        getattr(self, 'platform', None))
+        else:
+            settings = (self.browser, self.capture_network)
+        # sessions started on any of the hubs can be reused
+        address = self.hub_scheduler and self.hub_scheduler.addresses or \
+            (self.host, self.port)
+        return (self.api, address, self.base_url,
+                self.assume_untrusted, self.proxy_host,
+                self.proxy_port) + settings
+
+    def reset(self):
+        if self.webdriver:
+            handles = self.selenium.window_handles
+            for handle in handles[1:]:
+                self.selenium.switch_to_window(handle)
+                self.selenium.close()
+            self.selenium.switch_to_window(handles[0])
+            self.selenium.delete_all_cookies()
+            try:
+                self.selenium.execute_script(
+                    'window.localStorage.clear(); window.sessionStorage.clear();')
+            except:
+                # storage is not available on every page
+                pass
+            self.selenium.get('about:blank')
+            self.selenium.implicitly_wait(self.default_implicit_wait)
+        else:
+            self.selenium.delete_all_visible_cookies()
+            self.selenium.set_timeout(self.timeout)
+            self.selenium.set_context(self.test_id)
+
     @property
     def session_id(self):
         if self.webdriver:
@@ -171,8 +314,7 @@ class Client(object):
 
     def create_firefox_profile(self, preferences, profile_path, extensions):
         profile = webdriver.FirefoxProfile(profile_path)
-        if preferences:
-            [profile.set_preference(k, v) for k, v in json.loads(preferences).items()]
+        [profile.set_preference(k, v) for k, v in preferences.items()]
         profile.assume_untrusted_cert_issuer = self.assume_untrusted
         profile.update_preferences()
         for extension in extensions:
@@ -180,8 +322,8 @@ class Client(object):
         return profile
 
     def create_chrome_options(self, preferences, extensions):
-        options = webdriver.ChromeOptions()
-        options_from_json = json.loads(preferences)
+        options = ChromeOptions(self.chrome_options_cache)
+        options_from_json = preferences
 
         if 'arguments' in options_from_json:
             for args_ in options_from_json['arguments']:
@@ -244,6 +386,35 @@ class Client(object):
         except:
             return None
 
+    def capture(self, artifacts, timeout, deadline):
+        '''
+            Captures the named artifacts (such as 'screenshot' and 'html')
+            concurrently. Returns a dictionary of those that were captured
+            within timeout seconds, and no later than deadline seconds after
+            starting, along with a list of those that were not.
+        '''
+        results = {}
+
+        def capture_artifact(name):
+            results[name] = getattr(self, name)
+
+        threads = []
+        for name in artifacts:
+            thread = threading.Thread(target=capture_artifact, args=(name, ))
+            thread.daemon = True
+            thread.start()
+            threads.append((name, thread))
+
+        end = timer() + min(timeout, deadline)
+        timed_out = []
+        for name, thread in threads:
+            thread.join(max(0, end - timer()))
+            if thread.is_alive():
+                # leave the thread behind rather than holding up the run
+                timed_out.append(name)
+        return (dict((name, results[name]) for name, thread in threads
+                     if name not in timed_out), timed_out)
+
     def stop(self):
         try:
             if self.webdriver:
@@ -252,3 +423,46 @@ class Client(object):
                 self.selenium.stop()
         except:
             pass
+        finally:
+            self._release_hub()
+            self._release_slot()
+
+
+class ChromeOptions(webdriver.ChromeOptions):
+    '''
+        Chrome options that only read and encode each extension, and build
+        the resulting capabilities, once for all clients sharing the cache.
+    '''
+
+    def __init__(self, cache):
+        webdriver.ChromeOptions.__init__(self)
+        self.cache = cache
+
+    def _extension_keys(self):
+        # an extension is encoded again if the file has changed
+        keys = []
+        for path in self._extension_files:
+            stat = os.stat(path)
+            keys.append((path, stat.st_mtime, stat.st_size))
+        return keys
+
+    @property
+    def extensions(self):
+        encoded_extensions = []
+        for key in self._extension_keys():
+            if key not in self.cache['extensions']:
+                with open(key[0], 'rb') as f:
+                    self.cache['extensions'][key] = base64.b64encode(f.read())
+            encoded_extensions.append(self.cache['extensions'][key])
+        return encoded_extensions
+
+    def to_capabilities(self):
+        key = (tuple(self._extension_keys()),
+               self.binary_location,
+               tuple(self.arguments),
+               json.dumps(self.experimental_options, sort_keys=True))
+        if key not in self.cache['capabilities']:
+            self.cache['capabilities'][key] = copy.deepcopy(
+                webdriver.ChromeOptions.to_capabilities(self))
+        # the capabilities are modified before starting each browser
+        return copy.deepcopy(self.cache['capabilities'][key])
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+from timeit import default_timer as timer
+
+
+class SessionPool(object):
+    '''
+        Keeps idle browser sessions around so that tests with the same launch
+        configuration can reuse them instead of starting a new browser.
+    '''
+
+    def __init__(self, max_reuse=1, max_idle=5):
+        # 0 means that a session can be reused any number of times
+        self.max_reuse = max_reuse
+        self.max_idle = max_idle
+        self.idle = {}
+        # sessions shared by all tests within a class, module or session
+        self.scoped = {}
+        # sessions being started in the background for upcoming tests
+        self.warming = {}
+        # tests may acquire and release sessions from several threads
+        self._lock = threading.Lock()
+
+    def acquire(self, client, fresh=False, scope=None):
+        key = client.launch_key
+        with self._lock:
+            shared_client = scope is not None and self.scoped.get(scope, {}).get(key)
+        if shared_client:
+            shared_client.test_id = client.test_id
+            return shared_client
+        while not fresh:
+            with self._lock:
+                if not self.idle.get(key):
+                    break
+                idle_client = self.idle[key].pop()
+            idle_client.test_id = client.test_id
+            try:
+                idle_client.reset()
+                return self._share(idle_client, scope)
+            except:
+                # the browser has gone away, so try the next one
+                idle_client.stop()
+        self._make_room(client)
+        client.start()
+        client.uses = 0
+        return self._share(client, scope)
+
+    def _make_room(self, client):
+        '''
+            Stops idle browsers, oldest first, until there is a session slot
+            for the client to start in, as idle browsers keep their slots
+            until they are stopped.
+        '''
+        while not client.reserve_slot():
+            with self._lock:
+                oldest = self._pop_oldest()
+            if oldest is None:
+                return
+            oldest.stop()
+
+    def _pop_oldest(self):
+        idle = [idle_client for clients in self.idle.values()
+                for idle_client in clients]
+        if not idle:
+            return None
+        oldest = min(idle, key=lambda idle_client: idle_client.released)
+        self.idle[oldest.launch_key].remove(oldest)
+        return oldest
+
+    def _share(self, client, scope):
+        if scope is not None:
+            with self._lock:
+                self.scoped.setdefault(scope, {})[client.launch_key] = client
+        return client
+
+    def release(self, client, fresh=False, scope=None):
+        if scope is not None:
+            # released when the scope ends
+            return
+        client.uses += 1
+        if fresh or not client.reusable or \
+                (self.max_reuse and client.uses >= self.max_reuse):
+            client.stop()
+        else:
+            client.released = timer()
+            with self._lock:
+                self.idle.setdefault(client.launch_key, []).append(client)
+                # stop the browsers that have been idle longest beyond the limit
+                surplus = []
+                while sum(len(clients) for clients in self.idle.values()) > self.max_idle:
+                    surplus.append(self._pop_oldest())
+            for idle_client in surplus:
+                idle_client.stop()
+
+    def prewarm(self, test_id, client):
+        thread = StartThread(client)
+        thread.start()
+        self.warming[test_id] = thread
+
+    def claim(self, test_id):
+        thread = self.warming.pop(test_id, None)
+        if thread is None:
+            return None
+        thread.join()
+        if not thread.ready:
+            # let the test start its own browser so that it reports the error
+            thread.client.stop()
+            return None
+        thread.client.uses = 0
+        return thread.client
+
+    def discard(self, test_id=None, keep=()):
+        test_ids = test_id is None and list(self.warming) or [test_id]
+        for test_id in test_ids:
+            if test_id in keep:
+                continue
+            thread = self.warming.pop(test_id, None)
+            if thread is not None:
+                thread.join()
+                thread.client.stop()
+
+    def end_scope(self, scope):
+        for client in self.scoped.pop(scope, {}).values():
+            self.release(client)
+
+    def clear(self):
+        self.discard()
+        for scope in list(self.scoped):
+            self.end_scope(scope)
+        for clients in self.idle.values():
+            for client in clients:
+                client.stop()
+        self.idle.clear()
+
+
+class StartThread(threading.Thread):
+
+    def __init__(self, client):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.client = client
+        self.ready = False
+
+    def run(self):
+        try:
+            self.client.start()
+            self.ready = True
+        except:
+            pass
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import copy
+import Queue
+import sys
+import threading
+
+from _pytest.runner import call_and_report
+
+
+def _function_scoped(fixturedef):
+    return (fixturedef.scope or 'function') == 'function'
+
+
+def own_fixtures(item):
+    '''
+        Gives the test its own copy of each function scoped fixture it uses,
+        as a fixture caches its value for the test using it, and tests
+        running on other threads would otherwise be given that value.
+    '''
+    info = getattr(item, '_fixtureinfo', None)
+    if info is None:
+        return
+    name2fixturedefs = {}
+    for name, fixturedefs in info.name2fixturedefs.items():
+        owned = []
+        for fixturedef in fixturedefs or ():
+            if _function_scoped(fixturedef):
+                fixturedef = copy.copy(fixturedef)
+                fixturedef._finalizer = []
+                fixturedef.__dict__.pop('cached_result', None)
+            owned.append(fixturedef)
+        name2fixturedefs[name] = fixturedefs and type(fixturedefs)(owned)
+    item._fixtureinfo = info.__class__(
+        info.argnames, info.names_closure, name2fixturedefs)
+    item._initrequest()
+
+
+def shares_fixtures(item):
+    '''
+        Returns whether the test uses any fixtures scoped to its class,
+        module or session, which are shared with other tests.
+    '''
+    info = getattr(item, '_fixtureinfo', None)
+    return info is not None and not all(
+        _function_scoped(fixturedef)
+        for fixturedefs in info.name2fixturedefs.values()
+        for fixturedef in fixturedefs or ())
+
+
+class SharedSetupState(object):
+    '''
+        Sets up each module and class once for all the threads, and only
+        tears it down once the last of its tests has finished, while each
+        thread sets up and tears down its own tests. The session is left to
+        be torn down at the end of the run.
+    '''
+
+    def __init__(self, setup_state, items):
+        self._setup_state = setup_state
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._remaining = {}
+        for item in items:
+            for node in item.listchain()[1:-1]:
+                self._remaining[node] = self._remaining.get(node, 0) + 1
+
+    def prepare(self, item):
+        self._local.item = item
+        self._local.finalizers = []
+        with self._lock:
+            for node in item.listchain()[:-1]:
+                self._setup(node, self._setup_state.stack)
+        self._local.stack = []
+        if shares_fixtures(item):
+            # only one thread at a time may create a shared fixture
+            with self._lock:
+                self._setup(item, self._local.stack)
+        else:
+            self._setup(item, self._local.stack)
+
+    def _setup(self, node, stack):
+        if node in stack:
+            if hasattr(node, '_prepare_exc'):
+                raise node._prepare_exc[0], node._prepare_exc[1], node._prepare_exc[2]
+            return
+        stack.append(node)
+        try:
+            node.setup()
+        except Exception:
+            node._prepare_exc = sys.exc_info()
+            raise
+
+    def addfinalizer(self, finalizer, colitem):
+        if colitem is not None and colitem is getattr(self._local, 'item', None):
+            self._local.finalizers.append(finalizer)
+        else:
+            with self._lock:
+                self._setup_state.addfinalizer(finalizer, colitem)
+
+    def _callfinalizers(self, colitem):
+        with self._lock:
+            self._setup_state._callfinalizers(colitem)
+
+    def teardown_exact(self, item, nextitem):
+        try:
+            finalizers, self._local.finalizers = self._local.finalizers, []
+            while finalizers:
+                finalizers.pop()()
+            if self._local.stack:
+                self._local.stack.pop().teardown()
+        finally:
+            with self._lock:
+                for node in item.listchain()[1:-1]:
+                    self._remaining[node] -= 1
+                stack = self._setup_state.stack
+                for node in reversed(stack[:]):
+                    if node.parent is not None and not self._remaining.get(node):
+                        stack.remove(node)
+                        self._setup_state._teardown_with_finalization(node)
+
+
+class ThreadedRunner(object):
+    '''
+        Runs tests on a pool of threads within this process. The tests run
+        without their output being captured, and their reports are logged
+        from the main thread as each one finishes.
+    '''
+
+    def __init__(self, session, threads):
+        self.session = session
+        self.threads = threads
+        self._queue = Queue.Queue()
+        self._results = Queue.Queue()
+        self._stop = threading.Event()
+
+    def run(self, items):
+        for item in items:
+            own_fixtures(item)
+            self._queue.put(item)
+        pluginmanager = self.session.config.pluginmanager
+        # capturing swaps sys.stdout for the whole process, so can only
+        # capture one test at a time
+        capture = pluginmanager.getplugin('capturemanager')
+        if capture:
+            pluginmanager.unregister(capture)
+        setup_state = self.session._setupstate
+        self.session._setupstate = SharedSetupState(setup_state, items)
+        try:
+            workers = []
+            for i in range(min(self.threads, len(items))):
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+            for i in range(len(items)):
+                item, reports, exc_info = self._results.get()
+                if exc_info:
+                    self._stop.set()
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                self._log(item, reports)
+                if self.session.shouldstop:
+                    self._stop.set()
+                    raise self.session.Interrupted(self.session.shouldstop)
+            for worker in workers:
+                worker.join()
+        finally:
+            self.session._setupstate = setup_state
+            if capture:
+                pluginmanager.register(capture, 'capturemanager')
+
+    def _next(self):
+        if self._stop.is_set():
+            return None
+        try:
+            return self._queue.get_nowait()
+        except Queue.Empty:
+            return None
+
+    def _work(self):
+        item = self._next()
+        while item is not None:
+            try:
+                reports, nextitem = self._run(item)
+                self._results.put((item, reports, None))
+            except Exception:
+                self._results.put((item, None, sys.exc_info()))
+                return
+            item = nextitem
+
+    def _run(self, item):
+        # follows runtestprotocol, except that the next test is only taken
+        # once this one has run, so that other threads can take it sooner,
+        # and before this one is torn down, so that fixtures it shares with
+        # this one are kept
+        if hasattr(item, '_request') and not item._request:
+            item._initrequest()
+        reports = [call_and_report(item, 'setup', log=False)]
+        if reports[0].passed:
+            reports.append(call_and_report(item, 'call', log=False))
+        nextitem = self._next()
+        reports.append(call_and_report(item, 'teardown', log=False,
+                                       nextitem=nextitem))
+        if hasattr(item, '_request'):
+            item._request = False
+            item.funcargs = None
+        return reports, nextitem
+
+    def _log(self, item, reports):
+        item.ihook.pytest_runtest_logstart(
+            nodeid=item.nodeid, location=item.location)
+        for report in reports:
+            item.ihook.pytest_runtest_logreport(report=report)
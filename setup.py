@@ -11,11 +11,20 @@ setup(name='pytest-mozwebqa',
       py_modules=[
         'pytest_mozwebqa.pytest_mozwebqa',
         'pytest_mozwebqa.credentials',
+        'pytest_mozwebqa.failure_storm',
+        'pytest_mozwebqa.grid',
+        'pytest_mozwebqa.history',
         'pytest_mozwebqa.html_report',
         'pytest_mozwebqa.selenium_client',
-        'pytest_mozwebqa.sauce_labs'],
+        'pytest_mozwebqa.sauce_labs',
+        'pytest_mozwebqa.session_pool',
+        'pytest_mozwebqa.http_session',
+        'pytest_mozwebqa.profile_cache',
+        'pytest_mozwebqa.screenshots',
+        'pytest_mozwebqa.threaded_runner'],
       install_requires=['pytest>=2.2.4', 'selenium>=2.26.0', 'pyyaml', 'requests'],
-      entry_points={'pytest11': ['pytest_mozwebqa = pytest_mozwebqa.pytest_mozwebqa']},
+      entry_points={'pytest11': ['pytest_mozwebqa = pytest_mozwebqa.pytest_mozwebqa'],
+                    'console_scripts': ['mozwebqa-history = pytest_mozwebqa.history:main']},
       license='Mozilla Public License 2.0 (MPL 2.0)',
       keywords='py.test pytest selenium saucelabs mozwebqa webqa qa mozilla',
       classifiers=[
@@ -35,6 +35,34 @@ def pytest_funcarg__webserver(request):
     return WebServer.webserver
 
 
+def pytest_funcarg__fakedriver(request):
+    """Adds a webdriver that does not need a browser, for --driver=FakeDriver"""
+    testdir = request.getfuncargvalue('testdir')
+    testdir.makeconftest("""
+        import base64
+        import itertools
+        import threading
+        from selenium import webdriver
+
+        class FakeDriver(object):
+            sessions = itertools.count()
+            started = []
+            quit_sessions = []
+            current_url = 'http://localhost/'
+            page_source = u'<html></html>'
+            def __init__(self):
+                self.session_id = str(next(self.sessions))
+                self.started.append(threading.current_thread().name)
+            def implicitly_wait(self, seconds):
+                pass
+            def get_screenshot_as_base64(self):
+                return base64.encodestring('screenshot')
+            def quit(self):
+                self.quit_sessions.append(self.session_id)
+        webdriver.FakeDriver = FakeDriver
+    """)
+
+
 class WebServer:
 
     pass
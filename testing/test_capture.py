@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+
+import pytest
+
+from pytest_mozwebqa.selenium_client import Client
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+
+class SlowClient(Client):
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    @property
+    def url(self):
+        return 'http://localhost/'
+
+    @property
+    def screenshot(self):
+        time.sleep(self.delay)
+        return 'screenshot'
+
+    @property
+    def html(self):
+        time.sleep(self.delay)
+        return '<html></html>'
+
+
+def testArtifactsAreCapturedConcurrently():
+    start = time.time()
+    artifacts, timed_out = SlowClient(0.5).capture(
+        ('url', 'screenshot', 'html'), timeout=5, deadline=5)
+    assert time.time() - start < 1
+    assert artifacts == {'url': 'http://localhost/',
+                         'screenshot': 'screenshot',
+                         'html': '<html></html>'}
+    assert timed_out == []
+
+
+def testPartialArtifactsAreReturnedAfterTimeout():
+    start = time.time()
+    artifacts, timed_out = SlowClient(5).capture(
+        ('url', 'screenshot', 'html'), timeout=0.5, deadline=5)
+    assert time.time() - start < 1
+    assert artifacts == {'url': 'http://localhost/'}
+    assert timed_out == ['screenshot', 'html']
+
+
+def testPartialArtifactsAreReturnedAfterDeadline():
+    artifacts, timed_out = SlowClient(5).capture(
+        ('url', 'screenshot'), timeout=5, deadline=0.5)
+    assert artifacts == {'url': 'http://localhost/'}
+    assert timed_out == ['screenshot']
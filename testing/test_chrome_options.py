@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import base64
+import os
+
+import pytest
+
+from pytest_mozwebqa.selenium_client import ChromeOptions
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+
+def pytest_funcarg__extension(request):
+    tmpdir = request.getfuncargvalue('tmpdir')
+    extension = tmpdir.join('extension.crx')
+    extension.write('extension')
+    return extension
+
+
+def create_options(cache, extension):
+    options = ChromeOptions(cache)
+    options.add_argument('--incognito')
+    options.add_extension(str(extension))
+    return options
+
+
+def testExtensionIsOnlyEncodedOnce(extension, monkeypatch):
+    cache = {'extensions': {}, 'capabilities': {}}
+    first = create_options(cache, extension).to_capabilities()
+    # the file is not read again if its size and modification time match,
+    # which are kept from before the change as the file system may not
+    # preserve the modification time exactly
+    stat = os.stat(str(extension))
+    extension.write('changed!!')
+    monkeypatch.setattr(os, 'stat', lambda path: stat)
+    second = create_options(cache, extension).to_capabilities()
+    assert first == second
+    assert second['chromeOptions']['extensions'] == [base64.b64encode('extension')]
+    assert len(cache['extensions']) == 1
+    assert len(cache['capabilities']) == 1
+
+
+def testExtensionIsEncodedAgainWhenChanged(extension):
+    cache = {'extensions': {}, 'capabilities': {}}
+    create_options(cache, extension).to_capabilities()
+    extension.write('changed')
+    capabilities = create_options(cache, extension).to_capabilities()
+    assert capabilities['chromeOptions']['extensions'] == [base64.b64encode('changed')]
+
+
+def testCachedCapabilitiesAreNotShared(extension):
+    cache = {'extensions': {}, 'capabilities': {}}
+    first = create_options(cache, extension).to_capabilities()
+    first['platform'] = 'LINUX'
+    second = create_options(cache, extension).to_capabilities()
+    assert 'platform' not in second or second['platform'] != 'LINUX'
+    assert second['chromeOptions']['args'] == ['--incognito']
@@ -5,14 +5,13 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import os
+import re
 import pytest
 
 pytestmark = pytestmark = [pytest.mark.skip_selenium,
                            pytest.mark.nondestructive]
 
-failure_files = ('screenshot.png', 'html.txt')
-log_file = 'log.txt'
-network_traffic_file = 'networktraffic.json'
+failure_artifacts = ('screenshots', 'html')
 
 
 def testDebugOnFail(testdir, webserver):
@@ -30,10 +29,10 @@ def testDebugOnFail(testdir, webserver):
                                 file_test)
     passed, skipped, failed = reprec.listoutcomes()
     assert len(failed) == 1
-    path = _test_debug_path(str(testdir.tmpdir))
-    for file in failure_files:
-        assert os.path.exists(os.path.join(path, file))
-        assert os.path.isfile(os.path.join(path, file))
+    for key in failure_artifacts:
+        paths = _artifact_paths(str(testdir.tmpdir), failed[0], key)
+        assert len(paths) == 1
+        assert os.path.isfile(paths[0])
 
 
 def testDebugOnXFail(testdir, webserver):
@@ -52,10 +51,10 @@ def testDebugOnXFail(testdir, webserver):
                                 file_test)
     passed, skipped, failed = reprec.listoutcomes()
     assert len(skipped) == 1
-    path = _test_debug_path(str(testdir.tmpdir))
-    for file in failure_files:
-        assert os.path.exists(os.path.join(path, file))
-        assert os.path.isfile(os.path.join(path, file))
+    for key in failure_artifacts:
+        paths = _artifact_paths(str(testdir.tmpdir), skipped[0], key)
+        assert len(paths) == 1
+        assert os.path.isfile(paths[0])
 
 
 def testNoDebugOnPass(testdir, webserver):
@@ -134,11 +133,11 @@ def testDebugWithReportSubdirectory(testdir, webserver):
         file_test)
     passed, skipped, failed = reprec.listoutcomes()
     assert len(failed) == 1
-    path = _test_debug_path(os.path.join(str(testdir.tmpdir),
-                                         report_subdirectory))
-    for file in failure_files:
-        assert os.path.exists(os.path.join(path, file))
-        assert os.path.isfile(os.path.join(path, file))
+    for key in failure_artifacts:
+        paths = _artifact_paths(os.path.join(str(testdir.tmpdir),
+                                             report_subdirectory), failed[0], key)
+        assert len(paths) == 1
+        assert os.path.isfile(paths[0])
 
 
 def testLogWhenPublic(testdir, webserver):
@@ -157,9 +156,9 @@ def testLogWhenPublic(testdir, webserver):
                                 file_test)
     passed, skipped, failed = reprec.listoutcomes()
     assert len(failed) == 1
-    path = _test_debug_path(str(testdir.tmpdir))
-    assert os.path.exists(os.path.join(path, log_file))
-    assert os.path.isfile(os.path.join(path, log_file))
+    paths = _artifact_paths(str(testdir.tmpdir), failed[0], 'logs')
+    assert len(paths) == 1
+    assert os.path.isfile(paths[0])
 
 
 def testNoLogWhenNotPublic(testdir, webserver):
@@ -178,8 +177,7 @@ def testNoLogWhenNotPublic(testdir, webserver):
         file_test)
     passed, skipped, failed = reprec.listoutcomes()
     assert len(failed) == 1
-    path = _test_debug_path(str(testdir.tmpdir))
-    assert not os.path.exists(os.path.join(path, log_file))
+    assert not failed[0].debug['logs']
 
 
 def testNoLogWhenPrivate(testdir, webserver):
@@ -199,8 +197,7 @@ def testNoLogWhenPrivate(testdir, webserver):
         file_test)
     passed, skipped, failed = reprec.listoutcomes()
     assert len(failed) == 1
-    path = _test_debug_path(str(testdir.tmpdir))
-    assert not os.path.exists(os.path.join(path, log_file))
+    assert not failed[0].debug['logs']
 
 
 def testCaptureNetworkTraffic(testdir, webserver):
@@ -220,16 +217,19 @@ def testCaptureNetworkTraffic(testdir, webserver):
         file_test)
     passed, skipped, failed = reprec.listoutcomes()
     assert len(passed) == 1
-    path = _test_debug_path(str(testdir.tmpdir))
-    json_data = open(os.path.join(path, network_traffic_file))
+    paths = _artifact_paths(str(testdir.tmpdir), passed[0], 'network_traffic')
+    assert len(paths) == 1
+    json_data = open(paths[0])
     import json
     data = json.load(json_data)
     json_data.close()
     assert len(data) > 0
 
 
-def _test_debug_path(root_path):
-    debug_path = os.path.join(root_path, 'debug')
-    for i in range(2):
-        debug_path = os.path.join(debug_path, os.listdir(debug_path)[0])
-    return debug_path
+def _artifact_paths(root_path, report, key):
+    # artifacts are stored once under debug/artifacts, named after a hash
+    # of their content, and recorded on the report
+    paths = [artifact['path'] for artifact in report.debug[key]]
+    for path in paths:
+        assert re.match(r'debug/artifacts/[0-9a-f]{40}\.\w+$', path.replace(os.path.sep, '/'))
+    return [os.path.join(root_path, path) for path in paths]
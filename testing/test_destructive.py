@@ -80,3 +80,19 @@ def testSkipDestructiveTestsIfForcedAndRunningAgainstSensitiveURL(testdir, webse
                                 file_test)
     passed, skipped, failed = reprec.listoutcomes()
     assert len(skipped) == 1
+
+
+def testBaseURLIsCheckedOncePerSession(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        @pytest.mark.parametrize('i', range(3))
+        def test_selenium(mozwebqa, i):
+            assert True
+    """)
+    request_count = webserver.request_count
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port, file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 3
+    assert webserver.request_count - request_count == 1
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import py
+import pytest
+
+from pytest_mozwebqa.failure_storm import FailureStorm
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+
+def _excinfo(exception):
+    try:
+        raise exception
+    except:
+        return py.code.ExceptionInfo()
+
+
+def testOnlySampleOfFailuresAreCapturedAfterThreshold():
+    storm = FailureStorm(threshold=2, sample=3)
+    fingerprint = storm.fingerprint(_excinfo(AssertionError('down')), 'http://localhost/')
+    assert [storm.record(fingerprint) for i in range(8)] == \
+        [True, True, False, False, True, False, False, True]
+    assert storm.storm == fingerprint
+    assert storm.describe(fingerprint) == \
+        '8 tests failed with AssertionError: down at http://localhost/'
+
+
+def testFailuresWithMessagesThatAreNotAsciiAreCounted():
+    storm = FailureStorm(threshold=1)
+    for message in (u'caf\xe9 is down', u'caf\xe9 is down'.encode('utf-8')):
+        fingerprint = storm.fingerprint(_excinfo(AssertionError(message)), 'http://localhost/')
+        assert fingerprint[1].startswith('caf')
+        assert storm.record(fingerprint)
+
+
+def testDifferentFailuresAreCountedSeparately():
+    storm = FailureStorm(threshold=1)
+    for url in ('http://localhost/a', 'http://localhost/b'):
+        fingerprint = storm.fingerprint(_excinfo(AssertionError('down')), url)
+        assert storm.record(fingerprint)
+    assert storm.storm is None
+
+
+def testRemainingTestsFailAfterStorm(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_first(mozwebqa):
+            assert False, 'down'
+        @pytest.mark.nondestructive
+        def test_second(mozwebqa):
+            assert False, 'down'
+        @pytest.mark.nondestructive
+        def test_third(mozwebqa):
+            assert False, 'down'
+        @pytest.mark.nondestructive
+        def test_fourth(mozwebqa):
+            assert True
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--webqareport=result.html',
+                                '--stormthreshold=2',
+                                '--stormabort',
+                                file_test)
+    reports = reprec.getreports('pytest_runtest_logreport')
+    failed = [report for report in reports if report.when == 'call' and report.failed]
+    assert [bool(report.debug['screenshots']) for report in failed] == [True, True, False]
+    errors = [report for report in reports if report.when == 'setup' and report.failed]
+    assert len(errors) == 1
+    assert 'failure storm was detected' in str(errors[0].longrepr)
+    assert '3 tests failed with AssertionError' in str(errors[0].longrepr)
+
+
+def testCaptureDeadlineCoversEveryArtifact(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import time
+        import pytest
+        from selenium import webdriver
+        class SlowDriver(webdriver.FakeDriver):
+            @property
+            def current_url(self):
+                time.sleep(1)
+                return 'http://localhost/'
+            def get_screenshot_as_base64(self):
+                time.sleep(5)
+        webdriver.SlowDriver = SlowDriver
+        @pytest.mark.nondestructive
+        def test_fail(mozwebqa):
+            assert False
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=SlowDriver',
+                                '--stormthreshold=5',
+                                '--capturetimeout=10',
+                                '--capturedeadline=2',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(failed) == 1
+    assert failed[0].debug['urls'] == ['http://localhost/']
+    assert 2 <= failed[0].timings['capture'] < 2.5
@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import socket
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from pytest_mozwebqa import grid
+from pytest_mozwebqa.selenium_client import Client
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """Stands in for the status endpoint of a selenium server."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        body = json.dumps(self.server.status)
+        self.send_response(self.server.status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        """Starts a session, or accepts any other command."""
+        self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        if self.path == '/wd/hub/session':
+            if self.server.refuse_sessions:
+                return self._respond(500, {'status': 13, 'value': {'message': 'no capacity'}})
+            session_id = '%s-%i' % (self.server.server_port, len(self.server.sessions))
+            self.server.sessions.append(session_id)
+            return self._respond(200, {'status': 0, 'sessionId': session_id, 'value': {}})
+        self._respond(200, {'status': 0, 'value': None})
+
+    def do_DELETE(self):
+        self.server.quit_sessions.append(self.path.split('/')[-1])
+        self._respond(200, {'status': 0, 'value': None})
+
+    def _respond(self, status_code, value):
+        body = json.dumps(value)
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_hub(request):
+    server = HTTPServer(('localhost', 0), StatusHandler)
+    server.requests = []
+    server.status = {'status': 0}
+    server.status_code = 200
+    server.sessions = []
+    server.quit_sessions = []
+    server.refuse_sessions = False
+    server.url = 'http://localhost:%s/wd/hub/status' % server.server_port
+    server.address = 'localhost:%s' % server.server_port
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    request.addfinalizer(server.shutdown)
+    return server
+
+
+def pytest_funcarg__hub(request):
+    return _start_hub(request)
+
+
+def pytest_funcarg__second_hub(request):
+    return _start_hub(request)
+
+
+def _unused_port():
+    s = socket.socket()
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def testStatusIsOk(hub):
+    assert grid.check_status(hub.url, timeout=5) is None
+    assert hub.requests == ['/wd/hub/status']
+
+
+def testStatusIsNotOk(hub):
+    hub.status_code = 500
+    assert 'did not return status code 200' in grid.check_status(hub.url, timeout=5)
+
+
+def testSauceLabsIsNotOperational(hub):
+    hub.status = {'service_operational': False, 'status_message': 'Down'}
+    assert grid.check_status(hub.url, timeout=5) == \
+        'Sauce Labs is not operational. (Status: Down)'
+
+
+def testServerIsUnreachable():
+    url = 'http://localhost:%s/wd/hub/status' % _unused_port()
+    assert 'Unable to reach the selenium server' in grid.check_status(url, timeout=5)
+
+
+def testCircuitBreakerTripsAfterConsecutiveFailures():
+    breaker = grid.CircuitBreaker(threshold=2)
+    breaker.failure(Exception('no capacity'))
+    breaker.success()
+    breaker.failure(Exception('no capacity'))
+    assert breaker.reason() is None
+    breaker.failure(Exception('no capacity'))
+    assert breaker.reason() == \
+        'Not starting a browser as the last 2 attempts failed. (Error: no capacity)'
+
+
+def testCircuitBreakerReasonCopesWithMessagesThatAreNotAscii():
+    breaker = grid.CircuitBreaker(threshold=1)
+    breaker.failure(Exception(u'caf\xe9 is busy'))
+    assert 'caf' in breaker.reason()
+    breaker.failure(Exception(u'caf\xe9 is busy'.encode('utf-8')))
+    assert 'caf' in breaker.reason()
+
+
+def testTestsFailWhenServerIsUnreachable(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_browser(mozwebqa):
+            pass
+        @pytest.mark.nondestructive
+        def test_another_browser(mozwebqa):
+            pass
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_no_browser(mozwebqa):
+            pass
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=Remote',
+                                '--browsername=firefox',
+                                '--platform=linux',
+                                '--port=%s' % _unused_port(),
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 1
+    assert len(failed) == 2
+    for report in failed:
+        assert 'Unable to reach the selenium server' in str(report.longrepr)
+
+
+def testTestsFailAfterConsecutiveStartFailures(testdir, webserver):
+    testdir.makeconftest("""
+        from selenium import webdriver
+        class BrokenDriver(object):
+            attempts = 0
+            def __init__(self):
+                BrokenDriver.attempts += 1
+                raise Exception('no capacity')
+        webdriver.BrokenDriver = BrokenDriver
+    """)
+    file_test = testdir.makepyfile("""
+        import pytest
+        from selenium import webdriver
+        @pytest.mark.nondestructive
+        def test_first(mozwebqa):
+            pass
+        @pytest.mark.nondestructive
+        def test_second(mozwebqa):
+            pass
+        @pytest.mark.nondestructive
+        def test_third(mozwebqa):
+            pass
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_attempts(mozwebqa):
+            assert webdriver.BrokenDriver.attempts == 2
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=BrokenDriver',
+                                '--maxstartfailures=2',
+                                '--startretries=0',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 1
+    assert len(failed) == 3
+    assert 'no capacity' in str(failed[0].longrepr)
+    assert 'Not starting a browser as the last 2 attempts failed' in str(failed[2].longrepr)
+
+
+def testStartIsRetriedWhenThereIsNoCapacity():
+    attempts = []
+
+    def start():
+        attempts.append(time.time())
+        if len(attempts) < 3:
+            raise Exception('All nodes are busy')
+    waited = grid.start_with_retry(start, retries=3, backoff=0.1)
+    assert len(attempts) == 3
+    assert 0.1 < waited < 0.5
+
+
+def testStartIsNotRetriedForOtherErrors():
+    attempts = []
+
+    def start():
+        attempts.append(time.time())
+        raise Exception('Invalid capabilities')
+    with pytest.raises(Exception):
+        grid.start_with_retry(start, retries=3, backoff=0.1)
+    assert len(attempts) == 1
+
+
+def testCapacityErrorsMayHaveMessagesThatAreNotAscii():
+    assert grid.is_capacity_error(Exception(u'N\u0153uds occup\xe9s: busy'))
+    assert not grid.is_capacity_error(Exception(u'Capabilit\xe9s invalides'))
+
+
+def testStartFailsAfterRetries():
+    attempts = []
+
+    def start():
+        attempts.append(time.time())
+        raise Exception('no capacity')
+    with pytest.raises(Exception):
+        grid.start_with_retry(start, retries=2, backoff=0)
+    assert len(attempts) == 3
+
+
+def testSessionSlotsAreSharedThroughDirectory(tmpdir):
+    # separate instances stand in for separate processes
+    first = grid.SessionSlots(str(tmpdir), 1, poll=0.05)
+    second = grid.SessionSlots(str(tmpdir), 1, poll=0.05)
+    slot, waited = first.acquire()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(second.acquire()))
+    thread.start()
+    time.sleep(0.3)
+    assert not result
+    first.release(slot)
+    thread.join(5)
+    slot, waited = result[0]
+    assert waited >= 0.3
+    second.release(slot)
+
+
+def testWaitingForSessionSlotTimesOut(tmpdir):
+    slots = grid.SessionSlots(str(tmpdir), 1, poll=0.05)
+    slot, waited = slots.acquire()
+    start = time.time()
+    with pytest.raises(Exception):
+        slots.acquire(timeout=0.2)
+    assert 0.2 <= time.time() - start < 2
+    slots.release(slot)
+
+
+def testSessionSlotIsNotWaitedForWithoutBlocking(tmpdir):
+    slots = grid.SessionSlots(str(tmpdir), 1, poll=0.05)
+    slot, waited = slots.acquire(block=False)
+    assert slot
+    assert slots.acquire(block=False)[0] is None
+    slots.release(slot)
+    slot, waited = slots.acquire(block=False)
+    assert slot
+    slots.release(slot)
+
+
+def testCapacityWaitIsReported(testdir, webserver):
+    testdir.makeconftest("""
+        from selenium import webdriver
+        class BusyDriver(object):
+            attempts = 0
+            def __init__(self):
+                BusyDriver.attempts += 1
+                if BusyDriver.attempts < 3:
+                    raise Exception('no capacity')
+                self.session_id = 'abc'
+            def implicitly_wait(self, seconds):
+                pass
+            def quit(self):
+                pass
+        webdriver.BusyDriver = BusyDriver
+    """)
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_browser(mozwebqa):
+            pass
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=BusyDriver',
+                                '--startbackoff=0.1',
+                                '--maxsessions=1',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 1
+    assert 0.1 < passed[0].timings['queue'] < 0.5
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.host = self.port = self.hub = None
+        self.hub_starts = []
+
+
+def testLeastLoadedHubIsChosen():
+    first = grid.Hub('first', 4444, capacity=2)
+    second = grid.Hub('second', 4444, capacity=4)
+    scheduler = grid.HubScheduler([first, second])
+    chosen = [scheduler.acquire()[0] for i in range(4)]
+    assert chosen == [first, second, second, first]
+    assert first.in_flight == 2
+    assert scheduler.acquire([first, second])[0] is None
+
+
+def testSchedulerWaitsForCapacity():
+    hub = grid.Hub('localhost', 4444, capacity=1)
+    scheduler = grid.HubScheduler([hub], poll=0.05)
+    scheduler.acquire()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(scheduler.acquire()))
+    thread.start()
+    time.sleep(0.3)
+    assert not result
+    scheduler.release(hub)
+    thread.join(5)
+    assert result[0][0] is hub
+    assert result[0][1] >= 0.3
+
+
+def testSessionIsStartedOnAnotherHubWhenOneFails():
+    first = grid.Hub('first', 4444)
+    second = grid.Hub('second', 4444)
+    scheduler = grid.HubScheduler([first, second])
+    client = FakeClient()
+
+    def start():
+        if client.host == 'first':
+            raise Exception('Could not start a new session')
+    scheduler.start(client, start)
+    assert client.hub is second
+    assert [(address, started) for address, seconds, started in client.hub_starts] == \
+        [('first:4444', False), ('second:4444', True)]
+    assert first.in_flight == 0
+    assert second.in_flight == 1
+
+
+def testCapacityWaitIncludesWaitingForHub():
+    class QueuedScheduler(object):
+        def start(self, client, start):
+            return 7.0
+
+    class QueuedClient(Client):
+        def __init__(self):
+            self.hub_scheduler = QueuedScheduler()
+            self.slot = None
+            self.start_retries = 0
+            self.start_backoff = 0
+
+    client = QueuedClient()
+    client.start()
+    assert client.capacity_wait == 7.0
+
+
+def testStartFailsWhenEveryHubFails():
+    scheduler = grid.HubScheduler([grid.Hub('first', 4444), grid.Hub('second', 4444)])
+    client = FakeClient()
+
+    def start():
+        raise Exception('Could not start a new session')
+    with pytest.raises(Exception):
+        scheduler.start(client, start)
+    assert len(client.hub_starts) == 2
+
+
+def testHubsThatAreDownAreNotUsed(hub):
+    down = grid.Hub('localhost', _unused_port())
+    up = grid.Hub('localhost', hub.server_port)
+    scheduler = grid.HubScheduler([down, up])
+    assert scheduler.check(timeout=5) is None
+    assert 'Unable to reach the selenium server' in down.down
+    assert scheduler.acquire()[0] is up
+
+
+def testInvalidHubIsRejected():
+    with pytest.raises(ValueError):
+        grid.parse_hub('localhost')
+    hub = grid.parse_hub('localhost:4444:5')
+    assert (hub.host, hub.port, hub.capacity) == ('localhost', 4444, 5)
+
+
+def testSessionsAreSpreadAcrossHubs(testdir, webserver, hub, second_hub):
+    file_test = testdir.makepyfile("""
+        import threading
+        import pytest
+        first = threading.Event()
+        second = threading.Event()
+        @pytest.mark.nondestructive
+        def test_first(mozwebqa):
+            first.set()
+            second.wait(10)
+            assert second.is_set()
+        @pytest.mark.nondestructive
+        def test_second(mozwebqa):
+            second.set()
+            first.wait(10)
+            assert first.is_set()
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--hub=%s:1' % hub.address,
+                                '--hub=%s:1' % second_hub.address,
+                                '--browsername=chrome',
+                                '--platform=linux',
+                                '--webqathreads=2',
+                                '--webqareport=report.html',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 2
+    assert len(hub.sessions) == 1
+    assert len(second_hub.sessions) == 1
+    assert hub.quit_sessions == hub.sessions
+    html = testdir.tmpdir.join('report.html').read()
+    assert 'id="hubs"' in html
+    assert html.count('<td>%s</td>' % hub.address) == 1
+
+
+def testSessionIsStartedOnAnotherHubWhenOneRefuses(testdir, webserver, hub, second_hub):
+    hub.refuse_sessions = True
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_browser(mozwebqa):
+            pass
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--hub=%s' % hub.address,
+                                '--hub=%s' % second_hub.address,
+                                '--browsername=chrome',
+                                '--platform=linux',
+                                '--startretries=0',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 1
+    assert len(second_hub.sessions) == 1
+
+
+def testStartBackoffMustBeANumber(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_browser(mozwebqa):
+            pass
+    """)
+    result = testdir.runpytest('--baseurl=http://localhost:%s' % webserver.port,
+                               '--startbackoff=soon',
+                               file_test)
+    assert result.ret != 0
+    result.stderr.fnmatch_lines(['*--startbackoff must be a number of seconds.*'])
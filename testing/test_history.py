@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import sqlite3
+import StringIO
+
+import pytest
+
+from pytest_mozwebqa import history
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+
+def _record(path, nodeid, outcome, duration, recorded, build=None, browser='firefox'):
+    connection = history.connect(path)
+    with connection:
+        connection.execute(
+            'INSERT INTO results (nodeid, recorded, outcome, duration, build, browser) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (nodeid, recorded, outcome, duration, build, browser))
+    connection.close()
+
+
+def _run(testdir, webserver, file_test, *args):
+    return testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                              '--webqahistory=history.sqlite',
+                              file_test,
+                              *args)
+
+
+def _names(reprec):
+    return [report.nodeid.split('::')[-1] for report in
+            reprec.getreports('pytest_runtest_logreport') if report.when == 'call']
+
+
+def testEstimatesUseRecentRuns(tmpdir):
+    path = str(tmpdir.join('history.sqlite'))
+    for i in range(6):
+        _record(path, 'test_a', 'passed', i == 0 and 100 or 2, i)
+    _record(path, 'test_a', 'skipped', 0, 7)
+    _record(path, 'test_b', 'failed', 3, 1)
+    assert history.estimates(path) == {'test_a': 2, 'test_b': 3}
+
+
+def testColumnsAreAddedToExistingHistory(tmpdir):
+    path = str(tmpdir.join('history.sqlite'))
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE results (nodeid TEXT, recorded REAL, '
+                       'outcome TEXT, duration REAL)')
+    connection.close()
+    _record(path, 'test_a', 'passed', 1, 0, build='1')
+    assert history.slowest(path) == [('test_a', 'firefox', 1)]
+
+
+def testEstimatesWithoutHistory(tmpdir):
+    assert history.estimates(str(tmpdir.join('history.sqlite'))) == {}
+
+
+def testShardsAreBalanced():
+    estimates = {'a': 10, 'b': 6, 'c': 5, 'd': 1}
+    assert history.plan_shards(['d', 'c', 'b', 'a'], estimates, 2) == \
+        [['a', 'd'], ['b', 'c']]
+
+
+def testTestsWithoutHistoryTakeAverageTime():
+    estimates = {'a': 4, 'b': 2}
+    assert history.longest_first(['b', 'new', 'a'], estimates) == ['a', 'new', 'b']
+    assert history.longest_first(['b', 'a'], {}) == ['b', 'a']
+
+
+def testDurationsAreRecorded(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_pass(mozwebqa):
+            pass
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_fail(mozwebqa):
+            assert False
+    """)
+    _run(testdir, webserver, file_test)
+    connection = history.connect(str(testdir.tmpdir.join('history.sqlite')))
+    results = connection.execute('SELECT nodeid, outcome FROM results ORDER BY nodeid').fetchall()
+    connection.close()
+    assert [(nodeid.split('::')[-1], outcome) for nodeid, outcome in results] == \
+        [('test_fail', 'failed'), ('test_pass', 'passed')]
+
+
+def testLongestTestsRunFirst(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import time
+        import pytest
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_short(mozwebqa):
+            pass
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_long(mozwebqa):
+            time.sleep(0.2)
+    """)
+    assert _names(_run(testdir, webserver, file_test)) == ['test_short', 'test_long']
+    assert _names(_run(testdir, webserver, file_test, '--longestfirst')) == \
+        ['test_long', 'test_short']
+
+
+def testOnlyTestsInShardRun(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_one(mozwebqa):
+            pass
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_two(mozwebqa):
+            pass
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_three(mozwebqa):
+            pass
+    """)
+    # every shard must be planned from the same history
+    first = _names(_run(testdir, webserver, file_test, '--shards=2', '--shard=1',
+                        '--webqahistory=first.sqlite'))
+    second = _names(_run(testdir, webserver, file_test, '--shards=2', '--shard=2',
+                         '--webqahistory=second.sqlite'))
+    assert len(first) == 2
+    assert len(second) == 1
+    assert sorted(first + second) == ['test_one', 'test_three', 'test_two']
+
+
+def testSlowestTests(tmpdir):
+    path = str(tmpdir.join('history.sqlite'))
+    _record(path, 'test_a', 'passed', 100, 0, build='1')
+    _record(path, 'test_a', 'passed', 2, 1, build='2')
+    _record(path, 'test_a', 'passed', 4, 2, build='3')
+    _record(path, 'test_a', 'passed', 10, 2, build='3', browser='chrome')
+    _record(path, 'test_b', 'skipped', 50, 2, build='3')
+    _record(path, 'test_b', 'passed', 1, 3)
+    assert history.slowest(path, builds=3) == [
+        ('test_a', 'chrome', 10), ('test_a', 'firefox', 3), ('test_b', 'firefox', 1)]
+    assert history.slowest(path, builds=3, limit=1) == [('test_a', 'chrome', 10)]
+
+
+def testDurationRegressions(tmpdir):
+    path = str(tmpdir.join('history.sqlite'))
+    for build in range(3):
+        _record(path, 'test_slower', 'passed', 2, build, build=str(build))
+        _record(path, 'test_same', 'passed', 2, build, build=str(build))
+        _record(path, 'test_quick', 'passed', 0.1, build, build=str(build))
+    _record(path, 'test_slower', 'passed', 5, 3, build='3')
+    _record(path, 'test_same', 'passed', 2.5, 3, build='3')
+    _record(path, 'test_quick', 'passed', 0.5, 3, build='3')
+    _record(path, 'test_new', 'passed', 10, 3, build='3')
+    assert history.regressions(path, builds=2) == [('test_slower', 'firefox', 2, 5)]
+
+
+def testFlakyTests(tmpdir):
+    path = str(tmpdir.join('history.sqlite'))
+    outcomes = {'test_flaky': ['passed', 'failed', 'passed', 'error'],
+                'test_broken': ['passed', 'failed', 'failed', 'failed'],
+                'test_fine': ['passed', 'passed', 'skipped', 'passed']}
+    for nodeid, results in outcomes.items():
+        for build, outcome in enumerate(results):
+            _record(path, nodeid, outcome, 1, build, build=str(build))
+    assert history.flaky(path) == [('test_flaky', 'firefox', 4, 2, 3),
+                                   ('test_broken', 'firefox', 4, 3, 1)]
+    # the last three builds only failed
+    assert history.flaky(path, builds=3) == [('test_flaky', 'firefox', 3, 2, 2)]
+
+
+def testRunsWithoutBuildAreBuildsOfTheirOwn(tmpdir):
+    path = str(tmpdir.join('history.sqlite'))
+    _record(path, 'test_a', 'passed', 2, 0, build='1')
+    _record(path, 'test_a', 'passed', 1, 1)
+    _record(path, 'test_a', 'passed', 4, 2)
+    _record(path, 'test_a', 'passed', 6, 3, build='1')
+    # build 1 ran most recently, and each run without a build counts once
+    assert history._builds(history.connect(path), 3) == ['1', '2.0', '1.0']
+    assert history.slowest(path, builds=2) == [('test_a', 'firefox', 4)]
+
+
+def testQueriesFromCommandLine(tmpdir):
+    path = str(tmpdir.join('history.sqlite'))
+    _record(path, 'test_a', 'passed', 3, 0, build='1')
+    out = StringIO.StringIO()
+    history.main(['--history=%s' % path, 'slowest'], out)
+    assert out.getvalue().splitlines() == ['Test    Browser  Duration',
+                                           'test_a  firefox  3.00']
+    with pytest.raises(SystemExit):
+        history.main(['--history=%s' % path, 'fastest'], out)
+
+
+def testResultsAreRecordedByBuildAndBrowser(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_fail(mozwebqa):
+            assert False
+    """)
+    _run(testdir, webserver, file_test, '--driver=FakeDriver', '--build=42')
+    connection = history.connect(str(testdir.tmpdir.join('history.sqlite')))
+    results = connection.execute(
+        'SELECT build, browser, outcome, url, session_id FROM results').fetchall()
+    connection.close()
+    assert len(results) == 1
+    build, browser, outcome, url, session_id = results[0]
+    assert (build, browser, outcome, url) == ('42', 'FakeDriver', 'failed', 'http://localhost/')
+    assert session_id is not None
+
+
+def testRunsWithoutBuildAreRecordedByTime(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_pass(mozwebqa):
+            pass
+    """)
+    _run(testdir, webserver, file_test)
+    connection = history.connect(str(testdir.tmpdir.join('history.sqlite')))
+    build, recorded = connection.execute('SELECT build, recorded FROM results').fetchone()
+    connection.close()
+    assert abs(float(build) - recorded) < 0.001
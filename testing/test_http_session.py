@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from selenium import webdriver
+from selenium.webdriver.remote.command import Command
+
+from pytest_mozwebqa import http_session
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+
+class HubHandler(BaseHTTPRequestHandler):
+    """Responds to every WebDriver command with a successful response."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self):
+        self.server.clients.add(self.client_address)
+        length = int(self.headers.getheader('content-length') or 0)
+        length and self.rfile.read(length)
+        body = json.dumps({'sessionId': 'abc', 'status': 0, 'value': {}})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_DELETE = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+def pytest_funcarg__hub(request):
+    server = HTTPServer(('localhost', 0), HubHandler)
+    server.clients = set()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def shutdown():
+        # the server only handles one connection at a time, so kept alive
+        # connections must be closed before it can shut down
+        http_session.close()
+        server.shutdown()
+    request.addfinalizer(shutdown)
+    return server
+
+
+def testRemoteConnectionKeepsConnectionAlive(hub):
+    http_session.configure()
+    executor = 'http://localhost:%s/wd/hub' % hub.server_port
+    driver = webdriver.Remote(
+        command_executor=http_session.RemoteConnection(executor),
+        desired_capabilities={'browserName': 'firefox'})
+    assert driver.session_id == 'abc'
+    driver.implicitly_wait(10)
+    driver.quit()
+    http_session.close()
+    assert len(hub.clients) == 1
+
+
+def testRemoteConnectionReturnsNonJSONBody(webserver):
+    connection = http_session.RemoteConnection(
+        'http://localhost:%s' % webserver.port)
+    response = connection._request('http://localhost:%s' % webserver.port)
+    assert response['status'] == 0
+    assert 'Success!' in response['value']
+
+
+def testRemoteConnectionExecutesCommand(hub):
+    connection = http_session.RemoteConnection(
+        'http://localhost:%s/wd/hub' % hub.server_port)
+    response = connection.execute(
+        Command.NEW_SESSION, {'desiredCapabilities': {'browserName': 'firefox'}})
+    assert response['sessionId'] == 'abc'
+    assert response['status'] == 0
+
+
+def testRemoteConnectionAcceptsEitherRequestSignature(hub):
+    # selenium 2.41 changed _request(url, data, method) to
+    # _request(method, url, body)
+    connection = http_session.RemoteConnection(
+        'http://localhost:%s/wd/hub' % hub.server_port)
+    # selenium may have resolved the host, so use the same url
+    url = connection._url + '/session'
+    assert connection._request(url, '{}', 'POST')['sessionId'] == 'abc'
+    assert connection._request(url, data='{}', method='POST')['sessionId'] == 'abc'
+    assert connection._request('POST', url, body='{}')['sessionId'] == 'abc'
+    assert connection._request('DELETE', url + '/abc')['status'] == 0
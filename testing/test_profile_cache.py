@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+import pytest
+from selenium import webdriver
+
+from pytest_mozwebqa.profile_cache import ProfileCache
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+extension = os.path.join(os.path.dirname(__file__), 'empty.xpi')
+
+
+class ProfileFactory(object):
+
+    def __init__(self):
+        self.profiles = []
+
+    def __call__(self, preferences=None):
+        profile = webdriver.FirefoxProfile()
+        for key, value in (preferences or {}).items():
+            profile.set_preference(key, value)
+        profile.update_preferences()
+        profile.add_extension(extension)
+        self.profiles.append(profile)
+        return profile
+
+
+def testProfileIsOnlyBuiltOnce():
+    create = ProfileFactory()
+    cache = ProfileCache()
+    first = cache.get(create, None, {}, [extension], False)
+    second = cache.get(create, None, {}, [extension], False)
+    assert len(create.profiles) == 1
+    assert first.encoded == second.encoded
+
+
+def testProfileIsRebuiltForDifferentPreferences():
+    create = ProfileFactory()
+    cache = ProfileCache()
+    cache.get(create, None, {}, [extension], False)
+    preferences = {'browser.startup.homepage': 'about:blank'}
+    cache.get(lambda: create(preferences), None, preferences, [extension], False)
+    assert len(create.profiles) == 2
+
+
+def testProfileTemporaryDirectoriesAreRemoved():
+    create = ProfileFactory()
+    ProfileCache().get(create, None, {}, [extension], False)
+    assert not os.path.exists(create.profiles[0].path)
+
+
+def testProfileIsKeptBetweenSessions(tmpdir):
+    create = ProfileFactory()
+    encoded = ProfileCache(str(tmpdir)).get(
+        create, None, {}, [extension], False).encoded
+    cached = ProfileCache(str(tmpdir)).get(
+        create, None, {}, [extension], False).encoded
+    assert len(create.profiles) == 1
+    assert cached == encoded
@@ -4,6 +4,8 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import hashlib
+import json
 import os
 import pytest
 
@@ -51,3 +53,167 @@ def testReportWithDirectory(testdir, webserver):
     report_file = os.path.sep.join([str(testdir.tmpdir), report])
     assert os.path.exists(report_file)
     assert os.path.isfile(report_file)
+
+
+def testReportIncludesPhaseTimings(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_pass(mozwebqa):
+            assert True
+        @pytest.mark.nondestructive
+        def test_fail(mozwebqa):
+            assert False
+    """)
+    report = 'result.html'
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--webqareport=%s' % report,
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 1
+    assert len(failed) == 1
+    html = testdir.tmpdir.join(report).read()
+    for result in _results(html):
+        assert len(result['timings']) == 5
+    assert len(_results(html)) == 2
+    assert 'id="timings"' in html
+    assert 'Browser Start' in html
+
+
+def testFailureArtifactsAreWrittenWhenCaptured(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_fail(mozwebqa):
+            assert False
+    """)
+    report = 'result.html'
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--webqareport=%s' % report,
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(failed) == 1
+    debug = failed[0].debug
+    assert debug['screenshots'] == [{
+        'path': os.path.join('debug', 'artifacts', '%s.png' % hashlib.sha1('screenshot').hexdigest()),
+        'size': len('screenshot')}]
+    assert len(debug['html']) == 1
+    assert not debug['logs']
+    debug_path = testdir.tmpdir.join(debug['screenshots'][0]['path'])
+    assert debug_path.read() == 'screenshot'
+    result = _results(testdir.tmpdir.join(report).read())[0]
+    assert result['screenshot'] == debug['screenshots'][0]['path']
+    assert ['Screenshot', debug['screenshots'][0]['path']] in result['links']
+
+
+def testLargeScreenshotsAreStoredScaledDown(testdir, webserver, fakedriver):
+    Image = pytest.importorskip('PIL.Image')
+    file_test = testdir.makepyfile("""
+        import base64
+        import StringIO
+        import pytest
+        from PIL import Image
+        from selenium import webdriver
+        class LargeScreenshotDriver(webdriver.FakeDriver):
+            def get_screenshot_as_base64(self):
+                output = StringIO.StringIO()
+                Image.new('RGB', (1600, 3200), 'white').save(output, 'PNG')
+                return base64.encodestring(output.getvalue())
+        webdriver.LargeScreenshotDriver = LargeScreenshotDriver
+        @pytest.mark.nondestructive
+        def test_fail(mozwebqa):
+            assert False
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=LargeScreenshotDriver',
+                                '--webqareport=result.html',
+                                '--screenshotmaxsize=800',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(failed) == 1
+    screenshot = failed[0].debug['screenshots'][0]
+    content = testdir.tmpdir.join(screenshot['path']).read('rb')
+    assert screenshot['path'] == os.path.join(
+        'debug', 'artifacts', '%s.png' % hashlib.sha1(content).hexdigest())
+    assert screenshot['size'] == len(content)
+    assert Image.open(str(testdir.tmpdir.join(screenshot['path']))).size == (400, 800)
+
+
+def testReportIsWrittenAsTestsFinish(testdir, webserver, fakedriver):
+    report = 'result.html'
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_first(mozwebqa):
+            assert True
+        @pytest.mark.nondestructive
+        def test_second(mozwebqa):
+            html = open('%s').read()
+            assert 'The test run has not finished.' in html
+            assert 'test_first' in html
+            assert 'test_second' not in html
+    """ % report)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--webqareport=%s' % report,
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 2
+    html = testdir.tmpdir.join(report).read()
+    assert 'The test run has not finished.' not in html
+    assert 'test_second' in html
+    assert html.rstrip().endswith('</html>')
+    assert not testdir.tmpdir.join(report + '.tmp').check()
+
+
+def testReportEmbedsResultsAsData(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_pass(mozwebqa):
+            assert True
+        @pytest.mark.nondestructive
+        def test_fail(mozwebqa):
+            assert '</script>' == ''
+    """)
+    report = 'result.html'
+    testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                       '--driver=FakeDriver',
+                       '--webqareport=%s' % report,
+                       file_test)
+    html = testdir.tmpdir.join(report).read()
+    assert html.count('</script>') == 3
+    results = dict((result['name'], result) for result in _results(html))
+    assert results['test_pass']['result'] == 'Passed'
+    assert 'log' not in results['test_pass']
+    assert results['test_fail']['result'] == 'Failed'
+    assert any(line.startswith('E   ') for line in results['test_fail']['log'])
+
+
+def _results(html):
+    data = html.split('id="results-data" type="text/plain">')[1].split('</script>')[0]
+    return [json.loads(line) for line in data.splitlines() if line]
+
+
+def testIdenticalArtifactsAreStoredOnce(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_fail_first(mozwebqa):
+            assert False
+        @pytest.mark.nondestructive
+        def test_fail_second(mozwebqa):
+            assert False
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--webqareport=result.html',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(failed) == 2
+    assert failed[0].debug['screenshots'] == failed[1].debug['screenshots']
+    assert failed[0].debug['html'] == failed[1].debug['html']
+    artifacts = testdir.tmpdir.join('debug', 'artifacts')
+    assert sorted(path.ext for path in artifacts.listdir()) == ['.png', '.txt']
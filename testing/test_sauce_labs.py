@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from pytest_mozwebqa import sauce_labs
+from pytest_mozwebqa.pytest_mozwebqa import XdistHooks
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+credentials = {'username': 'username', 'api-key': 'api-key'}
+
+
+class JobsHandler(BaseHTTPRequestHandler):
+    """Stands in for the Sauce Labs jobs REST API."""
+
+    def do_PUT(self):
+        length = int(self.headers.getheader('content-length'))
+        body = json.loads(self.rfile.read(length))
+        if self.server.failures:
+            self.server.failures -= 1
+            self.send_response(500)
+        else:
+            self.server.results[self.path] = body
+            self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def pytest_funcarg__api(request):
+    server = HTTPServer(('localhost', 0), JobsHandler)
+    server.results = {}
+    server.failures = 0
+    server.url = 'http://localhost:%s/rest/v1' % server.server_port
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    request.addfinalizer(server.shutdown)
+    return server
+
+
+def testResultsAreSent(api):
+    reporter = sauce_labs.ResultReporter(api_url=api.url)
+    reporter.send(sauce_labs.Job('abc'), {'passed': True}, credentials)
+    reporter.send(sauce_labs.Job('def'), {'passed': False}, credentials)
+    reporter.flush(timeout=30)
+    assert reporter.delivered == 2
+    assert reporter.dropped == 0
+    assert api.results == {
+        '/rest/v1/username/jobs/abc': {'passed': True},
+        '/rest/v1/username/jobs/def': {'passed': False}}
+
+
+def testFailedResultsAreRetried(api):
+    api.failures = 2
+    reporter = sauce_labs.ResultReporter(backoff=0, api_url=api.url)
+    reporter.send(sauce_labs.Job('abc'), {'passed': True}, credentials)
+    reporter.flush(timeout=30)
+    assert reporter.delivered == 1
+    assert api.results == {'/rest/v1/username/jobs/abc': {'passed': True}}
+
+
+def testResultsAreDroppedAfterRetries(api):
+    api.failures = 3
+    reporter = sauce_labs.ResultReporter(retries=2, backoff=0, api_url=api.url)
+    reporter.send(sauce_labs.Job('abc'), {'passed': True}, credentials)
+    reporter.flush(timeout=30)
+    assert reporter.delivered == 0
+    assert reporter.dropped == 1
+    assert not api.results
+
+
+def testResultsAreDroppedWithoutWaitingAfterLastAttempt(api):
+    api.failures = 1
+    reporter = sauce_labs.ResultReporter(retries=0, backoff=60, api_url=api.url)
+    reporter.send(sauce_labs.Job('abc'), {'passed': True}, credentials)
+    start = time.time()
+    reporter.flush(timeout=5)
+    assert time.time() - start < 5
+    assert reporter.dropped == 1
+
+
+def testResultsAreDroppedAfterFlushTimeout(api):
+    api.failures = 1
+    reporter = sauce_labs.ResultReporter(backoff=60, api_url=api.url)
+    reporter.send(sauce_labs.Job('abc'), {'passed': True}, credentials)
+    reporter.send(sauce_labs.Job('def'), {'passed': True}, credentials)
+    reporter.flush(timeout=0.5)
+    assert reporter.delivered == 0
+    assert reporter.dropped == 2
+
+
+def testResultsSentBySlavesAreCounted():
+    class Node(object):
+        pass
+    node = Node()
+    node.config = Node()
+    node.config._sauce_labs_reporter = sauce_labs.ResultReporter()
+    for results in ((2, 1), (3, 0)):
+        node.slaveoutput = {'sauce_labs_results': results}
+        XdistHooks().pytest_testnodedown(node, None)
+    assert node.config._sauce_labs_reporter.delivered == 5
+    assert node.config._sauce_labs_reporter.dropped == 1
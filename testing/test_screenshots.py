@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import StringIO
+
+import pytest
+
+from pytest_mozwebqa import screenshots
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+
+def testThumbnailIsScaledDown(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+    path = str(tmpdir.join('screenshot.png'))
+    Image.new('RGB', (1600, 1200), 'white').save(path)
+    thumbnail_path = str(tmpdir.join('thumbnail.png'))
+    size = screenshots.thumbnail(path, thumbnail_path)
+    assert size == tmpdir.join('thumbnail.png').size()
+    assert Image.open(thumbnail_path).size == screenshots.THUMBNAIL_SIZE
+
+
+def testNoThumbnailForInvalidScreenshot(tmpdir):
+    path = tmpdir.join('screenshot.png')
+    path.write('screenshot')
+    assert screenshots.thumbnail(str(path), str(tmpdir.join('thumbnail.png'))) is None
+    assert not tmpdir.join('thumbnail.png').check()
+
+
+def testScreenshotsAreProcessedInTheBackground(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+    processor = screenshots.ScreenshotProcessor(workers=2)
+    for i in range(4):
+        Image.new('RGB', (1600, 3200), 'white').save(str(tmpdir.join('%i.png' % i)))
+        processor.submit(str(tmpdir.join('%i.png' % i)),
+                         str(tmpdir.join('%i-thumbnail.png' % i)))
+    processor.flush()
+    for i in range(4):
+        # the screenshot itself is left as it was stored
+        assert Image.open(str(tmpdir.join('%i.png' % i))).size == (1600, 3200)
+        assert Image.open(str(tmpdir.join('%i-thumbnail.png' % i))).size == (120, 240)
+
+
+def testLargeScreenshotsAreCappedBeforeBeingStored():
+    Image = pytest.importorskip('PIL.Image')
+    processor = screenshots.ScreenshotProcessor(max_size=800)
+    large = _png(Image, (1600, 3200))
+    assert Image.open(StringIO.StringIO(processor.cap(large))).size == (400, 800)
+    small = _png(Image, (800, 600))
+    assert processor.cap(small) == small
+    assert processor.cap('screenshot') == 'screenshot'
+
+
+def testScreenshotsAreNotCappedByDefault():
+    Image = pytest.importorskip('PIL.Image')
+    processor = screenshots.ScreenshotProcessor(workers=0)
+    large = _png(Image, (1600, 3200))
+    assert processor.cap(large) == large
+
+
+def _png(Image, size):
+    output = StringIO.StringIO()
+    Image.new('RGB', size, 'white').save(output, 'PNG')
+    return output.getvalue()
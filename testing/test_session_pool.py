@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from pytest_mozwebqa.session_pool import SessionPool
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+
+class FakeSlots(object):
+
+    def __init__(self, size):
+        self.free = size
+
+
+class FakeClient(object):
+
+    reusable = True
+
+    def __init__(self, test_id, launch_key='firefox', slots=None):
+        self.test_id = test_id
+        self.launch_key = launch_key
+        self.started = self.stopped = False
+        self.resets = 0
+        self.slots = slots
+        self.slot = False
+
+    def reserve_slot(self):
+        if self.slots is None or self.slot:
+            return True
+        if self.slots.free:
+            self.slots.free -= 1
+            self.slot = True
+        return self.slot
+
+    def start(self):
+        self.started = True
+
+    def reset(self):
+        self.resets += 1
+
+    def stop(self):
+        self.stopped = True
+        if self.slot:
+            self.slots.free += 1
+            self.slot = False
+
+
+def testSessionIsStoppedByDefault():
+    pool = SessionPool()
+    client = pool.acquire(FakeClient('test_one'))
+    assert client.started
+    pool.release(client)
+    assert client.stopped
+    assert pool.acquire(FakeClient('test_two')) is not client
+
+
+def testSessionIsReusedWithSameLaunchConfiguration():
+    pool = SessionPool(max_reuse=0)
+    client = pool.acquire(FakeClient('test_one'))
+    pool.release(client)
+    assert not client.stopped
+    reused = pool.acquire(FakeClient('test_two'))
+    assert reused is client
+    assert reused.test_id == 'test_two'
+    assert reused.resets == 1
+
+
+def testSessionIsNotReusedWithDifferentLaunchConfiguration():
+    pool = SessionPool(max_reuse=0)
+    client = pool.acquire(FakeClient('test_one'))
+    pool.release(client)
+    assert pool.acquire(FakeClient('test_two', 'chrome')) is not client
+
+
+def testSessionIsRecycledAfterMaxReuse():
+    pool = SessionPool(max_reuse=2)
+    client = pool.acquire(FakeClient('test_one'))
+    pool.release(client)
+    assert pool.acquire(FakeClient('test_two')) is client
+    pool.release(client)
+    assert client.stopped
+    assert pool.acquire(FakeClient('test_three')) is not client
+
+
+def testFreshSessionIsNeverReused():
+    pool = SessionPool(max_reuse=0)
+    client = pool.acquire(FakeClient('test_one'))
+    pool.release(client)
+    fresh = pool.acquire(FakeClient('test_two'), fresh=True)
+    assert fresh is not client
+    pool.release(fresh, fresh=True)
+    assert fresh.stopped
+
+
+def testSessionIsReplacedWhenResetFails():
+    pool = SessionPool(max_reuse=0)
+    client = pool.acquire(FakeClient('test_one'))
+
+    def reset():
+        raise Exception('browser has gone away')
+    client.reset = reset
+    pool.release(client)
+    replacement = pool.acquire(FakeClient('test_two'))
+    assert replacement is not client
+    assert client.stopped
+    assert replacement.started
+
+
+def testIdleSessionsAreStoppedOnClear():
+    pool = SessionPool(max_reuse=0)
+    client = pool.acquire(FakeClient('test_one'))
+    pool.release(client)
+    pool.clear()
+    assert client.stopped
+
+
+def testIdleSessionsAreStoppedToMakeRoom():
+    slots = FakeSlots(2)
+    pool = SessionPool(max_reuse=0)
+    first = pool.acquire(FakeClient('test_one', 'firefox', slots))
+    second = pool.acquire(FakeClient('test_two', 'chrome', slots))
+    pool.release(first)
+    pool.release(second)
+    third = pool.acquire(FakeClient('test_three', 'opera', slots))
+    assert third.started
+    assert first.stopped
+    assert not second.stopped
+    assert pool.acquire(FakeClient('test_four', 'chrome', slots)) is second
+
+
+def testLongestIdleSessionsAreStoppedOverLimit():
+    pool = SessionPool(max_reuse=0, max_idle=2)
+    clients = [pool.acquire(FakeClient('test_%i' % i, key))
+               for i, key in enumerate(('firefox', 'chrome', 'firefox'))]
+    for client in clients:
+        pool.release(client)
+    assert [client.stopped for client in clients] == [True, False, False]
+    assert pool.acquire(FakeClient('test_3', 'firefox')) is clients[2]
+    assert pool.acquire(FakeClient('test_4', 'chrome')) is clients[1]
+
+
+def testBackgroundSessionsAreKeptWhenDiscarding():
+    pool = SessionPool()
+    pool.prewarm('test_two', FakeClient('test_two'))
+    pool.prewarm('test_three', FakeClient('test_three'))
+    discarded = pool.warming['test_two'].client
+    kept = pool.warming['test_three'].client
+    pool.discard(keep=['test_three'])
+    assert discarded.stopped
+    assert not kept.stopped
+    assert pool.claim('test_three') is kept
+
+
+def testSessionIsSharedWithinScope():
+    pool = SessionPool()
+    client = pool.acquire(FakeClient('test_one'), scope='class')
+    pool.release(client, scope='class')
+    assert not client.stopped
+    shared = pool.acquire(FakeClient('test_two'), scope='class')
+    assert shared is client
+    assert shared.test_id == 'test_two'
+    assert shared.resets == 0
+
+
+def testSessionIsNotSharedBetweenScopes():
+    pool = SessionPool()
+    client = pool.acquire(FakeClient('test_one'), scope='class')
+    assert pool.acquire(FakeClient('test_two'), scope='other') is not client
+
+
+def testSessionIsReleasedWhenScopeEnds():
+    pool = SessionPool()
+    client = pool.acquire(FakeClient('test_one'), scope='module')
+    pool.release(client, scope='module')
+    pool.end_scope('module')
+    assert client.stopped
+    assert pool.acquire(FakeClient('test_two'), scope='module') is not client
+
+
+def testBrowserIsSharedWithinClassScope(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        sessions = []
+        @pytest.mark.nondestructive
+        class TestShared:
+            def test_one(self, mozwebqa):
+                sessions.append(mozwebqa.selenium.session_id)
+            def test_two(self, mozwebqa):
+                sessions.append(mozwebqa.selenium.session_id)
+                assert sessions[0] == sessions[1]
+        @pytest.mark.nondestructive
+        def test_other(mozwebqa):
+            assert mozwebqa.selenium.session_id not in sessions
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--browserscope=class',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 3
+
+
+def testBrowserIsStartedInBackgroundForNextTest(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import threading
+        import pytest
+        from selenium import webdriver
+        @pytest.mark.nondestructive
+        def test_one(mozwebqa):
+            assert webdriver.FakeDriver.started[0] == 'MainThread'
+        @pytest.mark.nondestructive
+        def test_two(mozwebqa):
+            assert webdriver.FakeDriver.started[1] != 'MainThread'
+            assert mozwebqa.selenium.session_id == '1'
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--prewarm=1',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 2
+
+
+def testBackgroundBrowserIsKeptThroughSkipSelenium(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        from selenium import webdriver
+        @pytest.mark.nondestructive
+        def test_one(mozwebqa):
+            pass
+        @pytest.mark.nondestructive
+        @pytest.mark.skip_selenium
+        def test_two(mozwebqa):
+            assert webdriver.FakeDriver.quit_sessions == ['0']
+        @pytest.mark.nondestructive
+        def test_three(mozwebqa):
+            assert mozwebqa.selenium.session_id == '1'
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--prewarm=2',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 3
+
+
+def testBackgroundBrowsersAreOnlyStartedWithFreeSessionSlots(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        from selenium import webdriver
+        @pytest.mark.nondestructive
+        def test_one(mozwebqa):
+            pass
+        @pytest.mark.nondestructive
+        def test_two(mozwebqa):
+            assert webdriver.FakeDriver.started[1] == 'MainThread'
+        @pytest.mark.nondestructive
+        def test_three(mozwebqa):
+            pass
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--prewarm=2',
+                                '--maxsessions=1',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 3
+
+
+def testIdleBrowserIsStoppedForFreshBrowser(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_one(mozwebqa):
+            pass
+        @pytest.mark.nondestructive
+        @pytest.mark.fresh_browser
+        def test_two(mozwebqa):
+            pass
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--maxreuse=0',
+                                '--maxsessions=1',
+                                '--sessionslottimeout=10',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 2
+
+
+def testWaitingForSessionSlotTimesOut(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_one(mozwebqa):
+            pass
+        @pytest.mark.nondestructive
+        @pytest.mark.fresh_browser
+        def test_two(mozwebqa):
+            pass
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--browserscope=module',
+                                '--maxsessions=1',
+                                '--sessionslottimeout=1',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 1
+    assert len(failed) == 1
+    assert 'waiting for one of the 1 browsers allowed by --maxsessions' in \
+        str(failed[0].longrepr)
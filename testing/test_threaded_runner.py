@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pytest
+
+pytestmark = pytestmark = [pytest.mark.skip_selenium,
+                           pytest.mark.nondestructive]
+
+
+def testBrowserTestsRunAtTheSameTime(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import threading
+        import pytest
+        first = threading.Event()
+        second = threading.Event()
+        @pytest.mark.nondestructive
+        def test_first(mozwebqa):
+            first.set()
+            # only set in time if the other test is running alongside, and
+            # wait returns None before python 2.7
+            second.wait(10)
+            assert second.is_set()
+        @pytest.mark.nondestructive
+        def test_second(mozwebqa):
+            second.set()
+            first.wait(10)
+            assert first.is_set()
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_no_browser(mozwebqa):
+            assert threading.current_thread().name == 'MainThread'
+            assert not first.is_set()
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--webqathreads=2',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 3
+    assert len(failed) == 0
+
+
+def testDestructiveTestsRunOneAtATime(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import threading
+        def test_destructive(mozwebqa):
+            assert threading.current_thread().name == 'MainThread'
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--destructive',
+                                '--webqathreads=2',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 1
+
+
+def testFailuresAreReported(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_pass(mozwebqa):
+            pass
+        @pytest.mark.nondestructive
+        def test_fail(mozwebqa):
+            assert False
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--webqathreads=2',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 1
+    assert len(failed) == 1
+
+
+def testModulesAreSetUpOnceForAllThreads(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        calls = []
+        def setup_module(module):
+            calls.append('setup')
+        def teardown_module(module):
+            calls.append('teardown')
+        @pytest.fixture(scope='module')
+        def shared(request):
+            calls.append('fixture')
+            request.addfinalizer(lambda: calls.append('finalizer'))
+        @pytest.mark.nondestructive
+        @pytest.mark.parametrize('i', range(6))
+        def test_module_is_set_up(mozwebqa, shared, i):
+            assert calls == ['setup', 'fixture']
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--webqathreads=3',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 6
+    assert len(failed) == 0
+    module = reprec.getcalls('pytest_collectreport')[-1].report.result[0].module
+    assert module.calls == ['setup', 'fixture', 'finalizer', 'teardown']
+
+
+def testTestsRunningAtTheSameTimeHaveTheirOwnBrowsers(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import threading
+        import pytest
+        first = threading.Event()
+        second = threading.Event()
+        @pytest.fixture
+        def session_id(mozwebqa):
+            return mozwebqa.selenium.session_id
+        def check(request, mozwebqa, session_id, started, other):
+            started.set()
+            # both tests hold their fixtures while the other one starts
+            other.wait(10)
+            assert other.is_set()
+            assert mozwebqa is request.node.mozwebqa
+            assert session_id == mozwebqa.selenium.session_id
+        @pytest.mark.nondestructive
+        def test_first(request, mozwebqa, session_id):
+            check(request, mozwebqa, session_id, first, second)
+        @pytest.mark.nondestructive
+        def test_second(request, mozwebqa, session_id):
+            check(request, mozwebqa, session_id, second, first)
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--webqathreads=2',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 2
+    assert len(failed) == 0
+
+
+def testTestsUsingParametrizedFixturesRunOneAtATime(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import threading
+        import pytest
+        @pytest.fixture(params=[1, 2])
+        def number(request):
+            return request.param
+        @pytest.mark.nondestructive
+        def test_parametrized(mozwebqa, number):
+            assert threading.current_thread().name == 'MainThread'
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                '--webqathreads=2',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 2
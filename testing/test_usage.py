@@ -217,3 +217,102 @@ def testShouldErrorThatItCantFindTheChromeBinary(testdir, webserver):
         pytest.fail('You must have Chrome Driver installed on your path for this test to run correctly. '
                     'For further information see pytest-mozwebqa documentation.')
     assert 'Could not find Chrome binary at: foo' in out
+
+
+def testShouldFailWithInvalidBrowserScope(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_selenium(mozwebqa):
+            assert True
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--browsername=firefox',
+                                '--platform=linux',
+                                '--browserscope=package',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(failed) == 1
+    out = failed[0].longrepr.reprcrash.message
+    assert out == 'UsageError: browser scope must be one of: class, ' \
+                  'function, module, session.'
+
+
+def testShouldStopAfterFirstUsageError(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_selenium1(mozwebqa):
+            assert True
+        @pytest.mark.nondestructive
+        def test_selenium2(mozwebqa):
+            assert True
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(failed) == 1
+    out = failed[0].longrepr.reprcrash.message
+    assert out == 'UsageError: --browsername must be specified when using ' \
+                  "the 'webdriver' api."
+
+
+def testShouldStopWithInvalidCapabilities(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_selenium1(mozwebqa):
+            assert True
+        @pytest.mark.nondestructive
+        def test_selenium2(mozwebqa):
+            assert True
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--browsername=firefox',
+                                '--platform=linux',
+                                '--capabilities={"foo"}',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(failed) == 1
+    out = failed[0].longrepr.reprcrash.message
+    assert out.startswith('UsageError: --capabilities must be valid JSON.')
+
+
+def testShouldFailWithInvalidBrowserName(testdir, webserver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        @pytest.mark.nondestructive
+        def test_selenium(mozwebqa):
+            assert True
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--browsername=foo',
+                                '--platform=linux',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(failed) == 1
+    out = failed[0].longrepr.reprcrash.message
+    assert out.startswith("UsageError: Invalid browser name: 'foo'.")
+
+
+def testEachTestHasItsOwnMozwebqa(testdir, webserver, fakedriver):
+    file_test = testdir.makepyfile("""
+        import pytest
+        seen = []
+        @pytest.mark.nondestructive
+        def test_selenium(mozwebqa):
+            assert mozwebqa.selenium is not None
+            seen.append(mozwebqa)
+        @pytest.mark.skip_selenium
+        @pytest.mark.nondestructive
+        def test_no_selenium(mozwebqa):
+            assert mozwebqa is not seen[0]
+            assert mozwebqa.selenium is None
+            assert seen[0].selenium is not None
+            assert mozwebqa.base_url == seen[0].base_url
+    """)
+    reprec = testdir.inline_run('--baseurl=http://localhost:%s' % webserver.port,
+                                '--driver=FakeDriver',
+                                file_test)
+    passed, skipped, failed = reprec.listoutcomes()
+    assert len(passed) == 2
@@ -33,6 +33,7 @@ class HtmlOnlyHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         """GET method handler."""
 
+        self.server.request_count += 1
         self.send_response(200)
         self.send_header('Content-type', 'text/html')
         self.end_headers()
@@ -53,6 +54,7 @@ class SimpleWebServer(object):
             try:
                 self.server = HTTPServer(
                     ('', port), HtmlOnlyHandler)
+                self.server.request_count = 0
                 self.port = port
                 break
             except socket.error:
@@ -69,6 +71,11 @@ class SimpleWebServer(object):
             self.server.handle_request()
         self.server.server_close()
 
+    @property
+    def request_count(self):
+        """Number of GET requests handled so far."""
+        return self.server.request_count
+
     def start(self):
         """Starts the server."""
         self.thread.start()